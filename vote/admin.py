@@ -1,10 +1,11 @@
 from django.contrib import admin
-from vote.models import Election, Candidate, Voter, VoteBallot, RankBallot
+from vote.models import Election, Candidate, Voter, VoteBallot, RankBallot, TallyJob
 
 admin.site.register(Election)
 admin.site.register(Candidate)
 admin.site.register(Voter)
 admin.site.register(VoteBallot)
 admin.site.register(RankBallot)
+admin.site.register(TallyJob)
 
 # Register your models here.
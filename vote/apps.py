@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class VoteConfig(AppConfig):
     name = 'vote'
+
+    def ready(self):
+        # Validate background tally settings at startup.
+        from vote import jobs
+        jobs.check_methods(jobs.BACKGROUND_METHODS)
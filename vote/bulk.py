@@ -0,0 +1,107 @@
+"""Bulk creation of elections and ballots, for generated and imported data."""
+import logging
+from typing import List
+
+import numpy as np
+from django.db import transaction
+
+from vote import voting
+from vote.models import (Election, Candidate, Voter, VoteBallot, RankBallot,
+    get_default_user)
+
+logger = logging.getLogger(__name__)
+
+# Default number of voters written per transaction.
+CHUNK_SIZE = 5000
+
+
+def create_election(etype: str, description: str, candidate_names: List[str],
+                    num_winners: int=1) -> Election:
+    """Create an election and its candidates."""
+    with transaction.atomic():
+        election = Election(
+            etype=etype,
+            description=description,
+            num_candidates=len(candidate_names),
+            num_winners=num_winners,
+        )
+        election.save()
+        candidates = [Candidate(name=name, election=election) for name in candidate_names]
+        Candidate.objects.bulk_create(candidates)
+    return election
+
+
+def bulk_create_ballots(election: Election, data: np.ndarray, user=None,
+                        candidate_ids: List[int]=None) -> int:
+    """Create one new voter per row of `data` and write their ballots.
+
+    All writes, including the persisted ballot matrix and voter counter,
+    happen in a single transaction. Call repeatedly with chunks of data
+    to keep memory and transaction size bounded.
+
+    Parameters
+    ----------
+    election : Election
+    data : array shape (a, b)
+        Ballots for `a` voters and `b` candidates, columns ordered by candidate id.
+    user : User or None
+        User of the new voters. Defaults to the anonymous user.
+    candidate_ids : list[int] or None
+        Sorted candidate ids of election. Retrieved if not given.
+
+    Returns
+    -------
+    num : int
+        Number of voters created.
+
+    Raises
+    ------
+    ValueError
+        If `data` has non-integer votes.
+    """
+    data = np.asarray(data)
+    if data.dtype.kind not in 'biu':
+        data = data.astype(float)
+        if not np.all(data == np.round(data)):
+            raise ValueError('Ballot votes must be whole numbers.')
+    data = data.astype(int)
+    if user is None:
+        user = get_default_user()
+    if candidate_ids is None:
+        candidate_ids = election.get_candidate_ids()
+    candidate_ids = np.asarray(candidate_ids)
+    num_voters = len(data)
+    if num_voters == 0:
+        return 0
+
+    with transaction.atomic():
+        # Lock the election row before adding voters, so concurrent writers
+        # are serialized and the latest voters of the election are ours.
+        Election.objects.select_for_update().values_list('pk').get(pk=election.pk)
+        voters = [Voter(election=election, user=user) for _ in range(num_voters)]
+        voters = Voter.objects.bulk_create(voters)
+        voter_ids = np.array([v.pk for v in voters])
+        if voter_ids[0] is None:
+            # Backend does not return ids from bulk inserts.
+            voter_ids = election.voter_set.order_by('-id').values_list('id', flat=True)
+            voter_ids = np.array(voter_ids[:num_voters])[::-1]
+
+        if election.ballot_type == voting.ID_SINGLE:
+            # Single-vote ballots only store the marked candidate.
+            vi, ci = np.nonzero(data)
+            ballots = [
+                VoteBallot(vote=True, election_id=election.pk, voter_id=v, candidate_id=c)
+                for v, c in zip(voter_ids[vi].tolist(), candidate_ids[ci].tolist())
+            ]
+            VoteBallot.objects.bulk_create(ballots, batch_size=CHUNK_SIZE)
+        else:
+            vmg, cmg = np.meshgrid(voter_ids, candidate_ids, indexing='ij')
+            ballots = [
+                RankBallot(vote=d, election_id=election.pk, voter_id=v, candidate_id=c)
+                for v, c, d in zip(vmg.ravel().tolist(), cmg.ravel().tolist(), data.ravel().tolist())
+            ]
+            RankBallot.objects.bulk_create(ballots, batch_size=CHUNK_SIZE)
+
+        election.append_ballots(data)
+        election.record_ballots(num_voters)
+    return num_voters
@@ -0,0 +1,44 @@
+"""Cache for post-processed election results.
+
+Results are keyed by election id and the election's ballot version, which
+is bumped whenever a ballot is submitted. Cached entries for old ballot
+versions are never read again and age out of the LRU cache.
+"""
+import logging
+import pickle
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Name of the cache in settings.CACHES used for results
+RESULTS_CACHE = getattr(settings, 'VOTE_RESULTS_CACHE', 'default')
+
+
+def results_cache():
+    """Get the cache used to store results."""
+    return caches[RESULTS_CACHE]
+
+
+def results_key(election, *parts) -> str:
+    """Build cache key for an election result at its current ballot version."""
+    parts = [str(p) for p in parts]
+    return ':'.join(['results', str(election.pk), str(election.ballot_version)] + parts)
+
+
+def cache_set(key: str, value):
+    """Store `value` in the results cache, logging values that cannot be pickled."""
+    try:
+        results_cache().set(key, value)
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        logger.warning('Result %s could not be cached: %s', key, e)
+
+
+def get_or_set(key: str, func):
+    """Retrieve `key` from the results cache, or call `func` and cache its return value."""
+    value = results_cache().get(key)
+    if value is None:
+        value = func()
+        cache_set(key, value)
+    return value
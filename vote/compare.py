@@ -0,0 +1,90 @@
+"""Comparison of election winners under every method valid for the ballot type.
+
+The ballot matrix is loaded once and all methods are tallied together,
+in parallel when the tally process pool is enabled. Tally results are
+shared with the results pages through the results cache.
+"""
+import numpy as np
+
+from vote import voting
+from vote import jobs
+from vote import executors
+from vote.models import Election
+from vote.post import load_ballot_data
+from vote.cache import cache_set, results_cache, results_key
+from vote.timing import timer
+
+
+def compare_methods(election: Election, numwinners: int=None,
+                    timeout: float=executors.TALLY_TIMEOUT) -> list:
+    """Tally the election under every method valid for its ballot type.
+
+    Parameters
+    ----------
+    election : Election
+    numwinners : int or None
+        Number of winners. Set to None to use the number specified for election.
+    timeout : float or None
+        Seconds to wait for the tallies in the tally process pool.
+
+    Returns
+    -------
+    rows : list[dict]
+        Row for each method with keys 'method', 'etype', 'winners', 'ties',
+        'error' and 'pending'. Pending methods are still being tallied by
+        a background job. Empty if the election has no voters.
+    """
+    if numwinners is None:
+        numwinners = election.num_winners
+    key = results_key(election, 'compare', numwinners)
+    rows = results_cache().get(key)
+    if rows is not None:
+        return rows
+
+    with timer('data'):
+        candidates = election.candidate_set.order_by('id').values_list('id', 'name')
+        candidate_ids = [c[0] for c in candidates]
+        candidate_names = np.array([c[1] for c in candidates])
+        data = load_ballot_data(election, candidate_ids)
+    if data.size == 0:
+        return []
+    voter_num = len(data)
+
+    methods = voting.get_ballot_type_methods(election.ballot_type)
+    results = {}
+    pending = set()
+    with timer('tally'):
+        for etype in methods.values():
+            results[etype] = results_cache().get(results_key(election, 'tally', etype, numwinners))
+            if results[etype] is None and jobs.use_background(etype, voter_num):
+                result, is_current = jobs.get_or_enqueue(election, etype, numwinners)
+                if is_current:
+                    results[etype] = result
+                else:
+                    pending.add(etype)
+
+        etypes = [e for e in methods.values() if results[e] is None and e not in pending]
+        new_results = executors.run_tallies(etypes, numwinners, data, timeout=timeout)
+        for etype, result in zip(etypes, new_results):
+            results[etype] = result
+            if not result['transient']:
+                cache_set(results_key(election, 'tally', etype, numwinners), result)
+
+    rows = []
+    for method_name, etype in methods.items():
+        result = results[etype]
+        row = dict(method=method_name, etype=etype, winners=[], ties=[], error=None,
+                   pending=False)
+        if result is None:
+            row['pending'] = True
+        elif result['error']:
+            row['error'] = result['output'].get('error', 'Error encountered during method calculation.')
+        else:
+            row['winners'] = candidate_names[result['winners']].tolist()
+            row['ties'] = candidate_names[result['ties']].tolist()
+        rows.append(row)
+
+    if not pending and not any(results[e]['transient'] for e in etypes):
+        # Loading data may have rebuilt the ballot matrix and bumped the ballot version.
+        cache_set(results_key(election, 'compare', numwinners), rows)
+    return rows
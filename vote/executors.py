@@ -0,0 +1,304 @@
+"""Bounded worker pools for CPU-heavy results work.
+
+Async views offload tallying, plotting and template rendering to a
+shared thread pool so the event loop stays free to serve other clients.
+The pool is bounded by the RESULTS_THREAD_WORKERS setting, which limits
+how many results pages are computed at once per process.
+
+Tallies can also be dispatched to a persistent process pool of
+TALLY_PROCESS_WORKERS processes, so votesim calculations holding the GIL
+do not serialize the threads of a web worker. Each web worker process
+creates its own pool on first use. Pool processes are started with the
+'forkserver' method where available, so they do not inherit the web
+worker's threads, locks and database connections. They only import
+`vote.worker` and `vote.tally`, which have no Django dependencies.
+
+A tally's timeout starts once a pool worker starts running it, as
+reported by the worker through a queue, so tallies
+queued behind other requests' work do not time out. When a tally times
+out, the pool is replaced: queued tallies move to the new pool, tallies
+already running are given time to finish, and then the old pool's
+processes, including the stuck one, are terminated.
+"""
+import itertools
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock, Thread
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+import numpy as np
+
+from vote import worker
+from vote.models import BALLOT_DTYPE
+from vote.tally import tally, error_result
+
+logger = logging.getLogger(__name__)
+
+# Max number of threads computing results per process.
+THREAD_WORKERS = getattr(settings, 'RESULTS_THREAD_WORKERS', 4)
+
+# Number of tally processes per web worker. 0 tallies in the calling thread.
+PROCESS_WORKERS = getattr(settings, 'TALLY_PROCESS_WORKERS', 0)
+
+# Default seconds to wait for a tally in the process pool.
+TALLY_TIMEOUT = getattr(settings, 'TALLY_TIMEOUT', 30.0)
+
+# multiprocessing start method of tally processes.
+START_METHOD = getattr(
+    settings, 'TALLY_PROCESS_START_METHOD',
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# Seconds between checks of running tallies for timeouts.
+POLL_INTERVAL = 0.05
+
+_thread_pool = None
+_process_pool = None
+_process_pool_lock = Lock()
+
+# Unfinished futures and queue of started task ids of each live process pool.
+_pool_futures = {}
+_pool_started = {}
+
+# Time each running tally task was started by a pool worker.
+_task_ids = itertools.count()
+_task_started = {}
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Get the process-wide results thread pool, created on first use."""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=THREAD_WORKERS, thread_name_prefix='results')
+    return _thread_pool
+
+
+def _call_with_connections(func, *args, **kwargs):
+    """Call `func`, closing stale and expired database connections of
+    the pool thread before and after, as Django does around requests."""
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_thread_pool(func, *args, **kwargs):
+    """Run sync function `func` in the results thread pool and await its result.
+
+    Context variables such as the request timings are copied to the thread.
+    """
+    call = sync_to_async(
+        _call_with_connections, thread_sensitive=False, executor=get_thread_pool())
+    return await call(func, *args, **kwargs)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the process-wide tally process pool, created on first use."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            context = multiprocessing.get_context(START_METHOD)
+            started = context.SimpleQueue()
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_WORKERS,
+                mp_context=context,
+                initializer=worker.init_worker,
+                initargs=(started,),
+            )
+            _pool_futures[_process_pool] = set()
+            _pool_started[_process_pool] = started
+            Thread(target=_read_started, args=(started,),
+                   name='tally-pool-started', daemon=True).start()
+        return _process_pool
+
+
+def _read_started(started):
+    """Record when pool workers start tasks, until None is received."""
+    while True:
+        task_id = started.get()
+        if task_id is None:
+            return
+        _task_started[task_id] = time.monotonic()
+
+
+def _submit(*args):
+    """Submit a tally to the process pool.
+
+    Returns
+    -------
+    pool : ProcessPoolExecutor
+    future : Future
+    task_id : int
+        Id under which the task's start time is recorded in `_task_started`.
+    """
+    task_id = next(_task_ids)
+    while True:
+        pool = get_process_pool()
+        try:
+            future = pool.submit(worker.run_task, task_id, tally, *args)
+        except RuntimeError:
+            # Retry if the pool was retired by another thread after we got it.
+            with _process_pool_lock:
+                if _process_pool is pool:
+                    raise
+            continue
+        except BrokenProcessPool:
+            _reset_process_pool(pool)
+            raise
+        break
+    with _process_pool_lock:
+        futures = _pool_futures.get(pool)
+        if futures is not None:
+            futures.add(future)
+            future.add_done_callback(futures.discard)
+    return pool, future, task_id
+
+
+def _terminate_workers(pool: ProcessPoolExecutor):
+    """Shut down `pool` and terminate its processes."""
+    if hasattr(pool, 'terminate_workers'):
+        # Python 3.14+
+        pool.terminate_workers()
+        return
+    # Older versions have no public API for this. `_processes` is a CPython
+    # implementation detail, checked by TestTallyProcessPool.test_timeout.
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _discard_process_pool(pool: ProcessPoolExecutor):
+    """Stop using `pool` for new tallies.
+
+    Returns
+    -------
+    futures : set or None
+        Unfinished futures of the pool, or None if it was already discarded.
+    started : SimpleQueue or None
+        Queue of started tasks of the pool.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+        return _pool_futures.pop(pool, None), _pool_started.pop(pool, None)
+
+
+def _reset_process_pool(pool: ProcessPoolExecutor):
+    """Discard broken `pool` and terminate its processes.
+    A new pool is created on next use."""
+    futures, started = _discard_process_pool(pool)
+    if futures is None:
+        return
+    _terminate_workers(pool)
+    started.put(None)
+
+
+def _retire_process_pool(pool: ProcessPoolExecutor, stuck: list):
+    """Replace `pool`, which has workers stuck on the timed out futures `stuck`.
+
+    New tallies go to a new pool, and queued tallies are cancelled so
+    their callers resubmit them there. Tallies already running in `pool`
+    get up to TALLY_TIMEOUT seconds to finish before its processes are
+    terminated in a background thread.
+    """
+    futures, started = _discard_process_pool(pool)
+    if futures is None:
+        return
+    futures = list(futures)
+    for future in futures:
+        # Only succeeds for tallies the pool has not started.
+        future.cancel()
+    running = [future for future in futures if not future.cancelled() and future not in stuck]
+
+    def terminate():
+        wait(running, timeout=TALLY_TIMEOUT)
+        _terminate_workers(pool)
+        started.put(None)
+    Thread(target=terminate, name='tally-pool-retire', daemon=True).start()
+
+
+def run_tally(etype: str, numwinners: int, ballots: np.ndarray, weights: np.ndarray=None,
+              timeout: float=TALLY_TIMEOUT) -> dict:
+    """Run election method `etype` on `ballots` weighted by `weights`,
+    see `vote.tally.tally`.
+
+    If the process pool is enabled, the tally runs in a pool process and
+    an error result is returned if it does not finish within `timeout`
+    seconds of starting. Set `timeout` to None to wait indefinitely.
+    """
+    return run_tallies([etype], numwinners, ballots, weights=weights, timeout=timeout)[0]
+
+
+def run_tallies(etypes: list, numwinners: int, ballots: np.ndarray, weights: np.ndarray=None,
+                timeout: float=TALLY_TIMEOUT) -> list:
+    """Run each election method of `etypes` on the same `ballots` weighted by `weights`.
+
+    If the process pool is enabled, the methods run in parallel and
+    methods not finished within `timeout` seconds of starting get an
+    error result. Otherwise methods run one after another in this thread.
+
+    Returns
+    -------
+    results : list[dict]
+        Tally result for each method, see `vote.tally.tally`.
+    """
+    if PROCESS_WORKERS <= 0:
+        return [tally(etype, numwinners, ballots, weights) for etype in etypes]
+
+    # Ballot values are small integers; send them in the compact stored dtype.
+    ballots = np.ascontiguousarray(ballots, dtype=BALLOT_DTYPE)
+    submitted = {}
+    task_ids = []
+    results = {}
+    stuck = {}
+    failed = error_result('Calculation process failed.', transient=True)
+
+    def submit(etype):
+        try:
+            submitted[etype] = _submit(etype, numwinners, ballots, weights)
+            task_ids.append(submitted[etype][2])
+        except BrokenProcessPool:
+            logger.exception('Tally process pool is broken.')
+            results[etype] = failed
+
+    for etype in etypes:
+        submit(etype)
+
+    while len(results) < len(etypes):
+        pending = [submitted[etype][1] for etype in etypes if etype not in results]
+        poll = None if timeout is None else POLL_INTERVAL
+        wait(pending, timeout=poll, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        for etype in etypes:
+            if etype in results:
+                continue
+            pool, future, task_id = submitted[etype]
+            if future.cancelled():
+                # Queued in a pool retired by another tally; move to the new pool.
+                submit(etype)
+            elif future.done():
+                try:
+                    results[etype] = future.result()
+                except BrokenProcessPool:
+                    logger.exception('Tally process pool broke running %s.', etype)
+                    _reset_process_pool(pool)
+                    results[etype] = failed
+            elif timeout is not None and task_id in _task_started:
+                if now - _task_started[task_id] >= timeout:
+                    logger.warning('Tally of %s timed out after %s s.', etype, timeout)
+                    results[etype] = error_result(
+                        f'Calculation took longer than {timeout:g} seconds.', transient=True)
+                    stuck.setdefault(pool, []).append(future)
+
+    for task_id in task_ids:
+        _task_started.pop(task_id, None)
+    for pool, futures in stuck.items():
+        _retire_process_pool(pool, futures)
+    return [results[etype] for etype in etypes]
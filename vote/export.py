@@ -0,0 +1,136 @@
+"""Streaming export of election ballots.
+
+Ballots are read from the ballot tables with a server-side cursor and
+written out one voter at a time, so memory use does not grow with the
+number of ballots. The Parquet export needs the optional pyarrow package.
+"""
+import csv
+import io
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from vote.models import Election, BALLOT_DTYPE
+
+# Number of ballot table rows fetched per database round trip.
+CHUNK_SIZE = 2000
+
+# Number of voters written per Parquet row group.
+PARQUET_BATCH_ROWS = 10000
+
+
+def get_column_names(election: Election, candidate_ids) -> list:
+    """Get export column names, the voter id followed by unique candidate names."""
+    names = dict(election.candidate_set.values_list('id', 'name'))
+    columns = ['voter']
+    for cid in candidate_ids:
+        name = names[cid]
+        while name in columns:
+            name = f'{name}_{cid}'
+        columns.append(name)
+    return columns
+
+
+def iter_ballot_rows(election: Election, candidate_ids=None, chunk_size: int=CHUNK_SIZE):
+    """Yield each voter's id and ballot, ordered by voter id.
+
+    Ballots are lists of votes with columns ordered by candidate id.
+    Unmarked candidates of single vote ballots are 0.
+    """
+    if candidate_ids is None:
+        candidate_ids = election.get_candidate_ids()
+    column = {cid : ii for ii, cid in enumerate(candidate_ids)}
+
+    ballots = election.get_ballots().order_by('voter_id')
+    ballots = ballots.values_list('voter_id', 'candidate_id', 'vote')
+    voter_id = None
+    row = None
+    for vid, cid, vote in ballots.iterator(chunk_size=chunk_size):
+        if vid != voter_id:
+            if row is not None:
+                yield voter_id, row
+            voter_id = vid
+            row = [0] * len(column)
+        row[column[cid]] = int(vote)
+    if row is not None:
+        yield voter_id, row
+
+
+class _Echo:
+    """File-like object returning written values, for streaming writers."""
+    def write(self, value):
+        return value
+
+
+def iter_csv(election: Election, chunk_size: int=CHUNK_SIZE):
+    """Yield CSV lines of the election's ballots, starting with a header."""
+    candidate_ids = election.get_candidate_ids()
+    writer = csv.writer(_Echo())
+    yield writer.writerow(get_column_names(election, candidate_ids))
+    for voter_id, row in iter_ballot_rows(election, candidate_ids, chunk_size):
+        yield writer.writerow([voter_id] + row)
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only buffer whose contents are taken out as chunks are streamed."""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self) -> bytes:
+        """Remove and return the data written so far."""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(election: Election, batch_rows: int=PARQUET_BATCH_ROWS,
+                 chunk_size: int=CHUNK_SIZE):
+    """Yield bytes of a Parquet file of the election's ballots.
+
+    One row group is written per `batch_rows` voters.
+    """
+    candidate_ids = election.get_candidate_ids()
+    columns = get_column_names(election, candidate_ids)
+    vote_type = pyarrow.from_numpy_dtype(BALLOT_DTYPE)
+    schema = pyarrow.schema(
+        [(columns[0], pyarrow.int64())] + [(name, vote_type) for name in columns[1:]])
+
+    buffer = _ChunkBuffer()
+    writer = pyarrow.parquet.ParquetWriter(buffer, schema)
+
+    def write_batch(batch):
+        voter_ids = np.array([ballot[0] for ballot in batch], dtype=np.int64)
+        data = np.array([ballot[1] for ballot in batch], dtype=BALLOT_DTYPE)
+        data = data.reshape(len(batch), len(candidate_ids))
+        arrays = [pyarrow.array(voter_ids)] + [pyarrow.array(col) for col in data.T]
+        writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+
+    batch = []
+    for ballot in iter_ballot_rows(election, candidate_ids, chunk_size):
+        batch.append(ballot)
+        if len(batch) >= batch_rows:
+            write_batch(batch)
+            batch = []
+            yield buffer.take()
+    if batch:
+        write_batch(batch)
+    writer.close()
+    yield buffer.take()
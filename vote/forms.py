@@ -1,7 +1,9 @@
 import logging
 from typing import List
 
+import numpy as np
 from django import forms
+from django.db import transaction, IntegrityError
 from django.db.models.query import QuerySet
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
@@ -14,7 +16,7 @@ from django.core.validators import MaxValueValidator, MinValueValidator
 # from crispy_forms.bootstrap import InlineRadios, Div
 
 from vote.models import (Election, Candidate, VoteBallot, RankBallot, Voter,
-    SCORE_MAX, user_is_anonymous, get_or_create_voter)
+    SCORE_MAX, user_is_anonymous, get_or_create_voter, get_default_user, clear_default_user)
 from vote import voting
 
 
@@ -106,22 +108,103 @@ class VoteForm(forms.Form):
 
 
     def save(self, user: User):
-        candidate_id = self.cleaned_data['candidate_id']
-        candidate = self._candidates.get(pk=candidate_id)
+        return save_refreshing_default_user(self._save, user)
+
+
+    def _save(self, user: User):
+        candidate_id = int(self.cleaned_data['candidate_id'])
+        candidates = list(self._candidates)
+        candidate = next(c for c in candidates if c.pk == candidate_id)
         election = candidate.election
-        voter = get_or_create_voter(election, user)
-        v = VoteBallot(vote=True, election=candidate.election, candidate=candidate, voter=voter)
-        v.save()
-        election.update_voter_num()
+
+        with transaction.atomic():
+            voter, created = get_or_create_voter(election, user)
+            v = VoteBallot(vote=True, election=election, candidate=candidate, voter=voter)
+            v.save()
+
+            candidate_votes = {c.pk : 0 for c in candidates}
+            candidate_votes[candidate.pk] = 1
+            election.append_ballot(candidate_votes)
+            election.record_ballot(new_voter=created)
         return
 
 
+def save_refreshing_default_user(save, user: User):
+    """Call `save(user)`. If `user` is the memoized anonymous user and its row
+    no longer exists, refresh the anonymous user and save again."""
+    try:
+        return save(user)
+    except IntegrityError:
+        if not user_is_anonymous(user):
+            raise
+        clear_default_user()
+        return save(get_default_user())
+
+
+ERROR_ALL_ZEROS = 'At least one candidate must be ranked or rated better than worst.'
+ERROR_REPEATED_RANKS = 'Ranks above "worst" cannot be repeated.'
+ERROR_INVALID_VALUE = 'Select a valid choice for every candidate.'
+ERROR_SINGLE_VOTE = 'Vote for exactly one candidate.'
+
+
 def _validate_rank_form_all_zeros(cleaned_data: dict):
     """Make sure ballot is not all zeros!"""
     for value in cleaned_data.values():
         if str(value) != "0":
             return True
-    raise ValidationError('At least one candidate must be ranked or rated better than worst.')
+    raise ValidationError(ERROR_ALL_ZEROS)
+
+
+def validate_ballot_matrix(data: np.ndarray, ballot_type: int) -> np.ndarray:
+    """Validate many ballots at once with the rules of the ballot forms.
+
+    Parameters
+    ----------
+    data : array shape (a, b)
+        Ballots for `a` voters and `b` candidates. Single vote ballots
+        mark the chosen candidate with 1 and all others with 0.
+    ballot_type : int
+        Ballot type id of the election, see `vote.voting`.
+
+    Returns
+    -------
+    errors : array shape (a,)
+        Error message for each ballot, or '' for valid ballots.
+    """
+    data = np.asarray(data, dtype=float)
+    cnum = data.shape[1]
+    whole = np.all(data == np.floor(data), axis=1)
+
+    # Choices of each form; RankForm uses 0 for the worst rank.
+    if ballot_type == voting.ID_RANK:
+        in_range = np.all((data >= 0) & (data <= cnum - 1), axis=1)
+    elif ballot_type == voting.ID_SCORE:
+        in_range = np.all((data >= 0) & (data <= SCORE_MAX), axis=1)
+    else:
+        in_range = np.all((data == 0) | (data == 1), axis=1)
+
+    errors = np.full(len(data), '', dtype=object)
+    if ballot_type == voting.ID_SINGLE:
+        errors[data.sum(axis=1) != 1] = ERROR_SINGLE_VOTE
+    else:
+        errors[np.all(data == 0, axis=1)] = ERROR_ALL_ZEROS
+    if ballot_type == voting.ID_RANK:
+        ranks = np.sort(data, axis=1)
+        repeated = np.any((ranks[:, 1:] == ranks[:, :-1]) & (ranks[:, 1:] != 0), axis=1)
+        errors[repeated] = ERROR_REPEATED_RANKS
+    errors[~(whole & in_range)] = ERROR_INVALID_VALUE
+    return errors
+
+
+def to_form_ranks(data: np.ndarray) -> np.ndarray:
+    """Convert votesim rankings 1 (best) to cnum (worst) to the RankForm convention.
+
+    The worst rank `cnum` becomes 0, so the result passes
+    `validate_ballot_matrix` and tallies the same as `data`.
+    """
+    data = np.asarray(data)
+    cnum = data.shape[1]
+    return np.where(data == cnum, 0, data)
 
 
 class RankForm(forms.Form):
@@ -160,7 +243,7 @@ class RankForm(forms.Form):
         for key, value in cleaned_data.items():
             if str(value) != "0":
                 if value in used_ranks:
-                    raise ValidationError('Ranks above "worst" cannot be repeated.')
+                    raise ValidationError(ERROR_REPEATED_RANKS)
                 else:
                     used_ranks.add(value)
         _validate_rank_form_all_zeros(cleaned_data)
@@ -168,22 +251,30 @@ class RankForm(forms.Form):
 
 
     def save(self, user: User):
-        return save_ranked(self, user)
+        return save_refreshing_default_user(lambda u: save_ranked(self, u), user)
 
 
 def save_ranked(self, user: User):
     """Save ScoreForm or RankForm as `self`."""
-    candidates = self._candidates
-    election = candidates.first().election
-    voter = get_or_create_voter(election, user)
-
-    for candidate in candidates:
-        candidate_id  = candidate.pk
-        field_name = 'candidate_' + str(candidate_id)
-        data = self.cleaned_data[field_name]
-        v = RankBallot(vote=data, election=election, candidate=candidate, voter=voter)
-        v.save()
-    election.update_voter_num()
+    candidates = list(self._candidates)
+    election = candidates[0].election
+
+    with transaction.atomic():
+        voter, created = get_or_create_voter(election, user)
+
+        ballots = []
+        candidate_votes = {}
+        for candidate in candidates:
+            candidate_id  = candidate.pk
+            field_name = 'candidate_' + str(candidate_id)
+            data = int(self.cleaned_data[field_name])
+            v = RankBallot(vote=data, election=election, candidate=candidate, voter=voter)
+            ballots.append(v)
+            candidate_votes[candidate_id] = data
+
+        RankBallot.objects.bulk_create(ballots)
+        election.append_ballot(candidate_votes)
+        election.record_ballot(new_voter=created)
     return
 
 
@@ -218,7 +309,7 @@ class ScoreForm(forms.Form):
 
 
     def save(self, user: User):
-        return save_ranked(self, user)
+        return save_refreshing_default_user(lambda u: save_ranked(self, u), user)
 
 
 def get_ballot_form(candidates : 'QuerySet[Candidate]', *args, **kwargs):
@@ -241,14 +332,8 @@ def get_ballot_form(candidates : 'QuerySet[Candidate]', *args, **kwargs):
 class RecalculateForm(forms.Form):
     def __init__(self, election : Election, *args, **kwargs):
         super(RecalculateForm, self).__init__(*args, **kwargs)
-        ballot_type = election.ballot_type
-        if ballot_type == voting.ID_SCORE:
-            etype_dict = voting.scored_methods
-        elif ballot_type == voting.ID_RANK:
-            etype_dict = voting.ranked_methods
-        elif ballot_type == voting.ID_SINGLE:
-            etype_dict = voting.single_methods
-
+        self.election = election
+        etype_dict = voting.get_ballot_type_methods(election.ballot_type)
         self.etype_dict = etype_dict
 
         etype = forms.ChoiceField(
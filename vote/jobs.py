@@ -0,0 +1,199 @@
+"""Background tallying of expensive election methods.
+
+Requests enqueue a `TallyJob` for the current ballot version of an
+election, and the `run_tally_worker` management command computes it off
+the request path. No external broker is needed; the job table is the queue.
+"""
+import logging
+import pickle
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from vote import voting
+from vote.models import Election, TallyJob
+from vote.tally import error_result
+
+logger = logging.getLogger(__name__)
+
+# Methods tallied in the background for large elections.
+BACKGROUND_METHODS = getattr(settings, 'TALLY_BACKGROUND_METHODS', [])
+
+# Min number of voters for which methods are tallied in the background.
+BACKGROUND_MIN_VOTERS = getattr(settings, 'TALLY_BACKGROUND_MIN_VOTERS', 5000)
+
+# Max number of times a job is run before it fails with an error result.
+MAX_ATTEMPTS = getattr(settings, 'TALLY_JOB_MAX_ATTEMPTS', 3)
+
+# Seconds to wait before running a job again after a failed attempt.
+RETRY_DELAY = getattr(settings, 'TALLY_JOB_RETRY_DELAY', 30.0)
+
+
+def check_methods(etypes: list):
+    """Raise ImproperlyConfigured if `etypes` has unknown election method ids."""
+    unknown = [etype for etype in etypes if etype not in voting.all_method_ids]
+    if unknown:
+        raise ImproperlyConfigured(
+            f'TALLY_BACKGROUND_METHODS has unknown election methods: {", ".join(map(str, unknown))}')
+
+
+def use_background(etype: str, voter_num: int) -> bool:
+    """Determine whether method `etype` is tallied by background jobs."""
+    return etype in BACKGROUND_METHODS and voter_num >= BACKGROUND_MIN_VOTERS
+
+
+def get_or_enqueue(election: Election, etype: str, numwinners: int):
+    """Get the latest completed tally result, and enqueue a job if it is out of date.
+
+    Returns
+    -------
+    result : dict or None
+        Latest completed tally result. None if no job has completed yet.
+    is_current : bool
+        True if the result is for the current ballot version.
+    """
+    version = election.ballot_version
+    jobs = TallyJob.objects.filter(election=election, etype=etype, numwinners=numwinners)
+
+    done = jobs.filter(status__in=[TallyJob.DONE, TallyJob.FAILED]).order_by('-ballot_version')
+    done = done.values_list('ballot_version', 'result').first()
+    if done is not None and done[0] == version:
+        return pickle.loads(done[1]), True
+
+    # get_or_create recovers from another request creating the job at once.
+    TallyJob.objects.get_or_create(
+        election=election, etype=etype, numwinners=numwinners, ballot_version=version)
+
+    if done is None:
+        return None, False
+    return pickle.loads(done[1]), False
+
+
+def delete_stale_jobs() -> int:
+    """Delete pending jobs for ballot versions older than their election's,
+    whose results would be out of date before they finish.
+    Returns number of jobs deleted."""
+    stale = TallyJob.objects.filter(
+        status=TallyJob.PENDING, ballot_version__lt=F('election__ballot_version'))
+    return stale.delete()[0]
+
+
+def claim_job():
+    """Claim the oldest pending job for this worker.
+    Pending jobs for outdated ballot versions are deleted first.
+
+    Returns
+    -------
+    job : TallyJob or None
+        Claimed job, or None if no jobs are pending.
+    """
+    delete_stale_jobs()
+    now = timezone.now()
+    pending = TallyJob.objects.filter(status=TallyJob.PENDING)
+    pending = pending.filter(Q(date_retry__isnull=True) | Q(date_retry__lte=now)).order_by('id')
+    for job in pending[:10]:
+        # Only one worker can win the update from pending to running.
+        claimed = TallyJob.objects.filter(pk=job.pk, status=TallyJob.PENDING).update(
+            status=TallyJob.RUNNING, date_started=now, attempts=F('attempts') + 1)
+        if claimed:
+            job.status = TallyJob.RUNNING
+            job.date_started = now
+            job.attempts += 1
+            return job
+    return None
+
+
+def run_job(job: TallyJob):
+    """Tally the election method of a claimed job and store the result."""
+    # Import here since vote.post uses this module.
+    from vote.post import PostElection
+
+    post = PostElection(job.election_id, etype=job.etype, numwinners=job.numwinners,
+                        timeout=None)
+    if post.error_no_voters:
+        result = error_result('No voters found.')
+    else:
+        result = post.result
+
+    if result.get('transient'):
+        # Tally process failed or timed out.
+        return retry_job(job, result['output']['error'])
+
+    # Ballots may have changed since the job was enqueued. Label the result
+    # with the ballot version read with the ballot data.
+    version = post.election.ballot_version
+    if version != job.ballot_version and not move_job(job, version):
+        job.delete()
+        return job
+    return finish_job(job, result)
+
+
+def move_job(job: TallyJob, version: int) -> bool:
+    """Relabel a running job to ballot `version`, replacing pending jobs
+    for that version and older ones.
+
+    Returns
+    -------
+    moved : bool
+        False if another job for the version has already been claimed.
+    """
+    jobs = TallyJob.objects.filter(
+        election_id=job.election_id, etype=job.etype, numwinners=job.numwinners)
+    try:
+        with transaction.atomic():
+            pending = jobs.filter(status=TallyJob.PENDING, ballot_version__lte=version)
+            pending.exclude(pk=job.pk).delete()
+            TallyJob.objects.filter(pk=job.pk).update(ballot_version=version)
+    except IntegrityError:
+        return False
+    job.ballot_version = version
+    return True
+
+
+def finish_job(job: TallyJob, result: dict, status: int=TallyJob.DONE):
+    """Store the tally result of a job with final `status`."""
+    job.result = pickle.dumps(result)
+    job.status = status
+    job.date_finished = timezone.now()
+    job.save(update_fields=['result', 'status', 'date_finished'])
+
+    # Older results for the method are no longer needed.
+    TallyJob.objects.filter(
+        election_id=job.election_id,
+        etype=job.etype,
+        numwinners=job.numwinners,
+        status__in=[TallyJob.DONE, TallyJob.FAILED],
+        ballot_version__lt=job.ballot_version,
+    ).delete()
+    return job
+
+
+def retry_job(job: TallyJob, message: str):
+    """Return a job whose attempt failed with error `message` to pending,
+    to run again after RETRY_DELAY seconds. After MAX_ATTEMPTS attempts,
+    the job fails instead and stores an error result, so results pages
+    stop waiting for it."""
+    if job.attempts >= MAX_ATTEMPTS:
+        logger.warning('Tally job %s failed after %s attempts: %s', job, job.attempts, message)
+        return finish_job(job, error_result(message), status=TallyJob.FAILED)
+
+    job.status = TallyJob.PENDING
+    job.date_started = None
+    job.date_retry = timezone.now() + timedelta(seconds=RETRY_DELAY)
+    job.save(update_fields=['status', 'date_started', 'date_retry'])
+    return job
+
+
+def requeue_stale_jobs(seconds: float) -> int:
+    """Retry running jobs started more than `seconds` ago, for jobs of
+    workers that died. Returns number of jobs retried or failed."""
+    cutoff = timezone.now() - timedelta(seconds=seconds)
+    jobs = TallyJob.objects.filter(status=TallyJob.RUNNING, date_started__lt=cutoff)
+    stale = list(jobs)
+    for job in stale:
+        retry_job(job, 'Calculation did not finish.')
+    return len(stale)
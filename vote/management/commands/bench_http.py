@@ -0,0 +1,96 @@
+"""Measure request throughput and latency of a running webvoter server.
+
+Run against the same URLs served by the WSGI and ASGI setups to compare
+them, for example::
+
+    gunicorn webvoter.wsgi --workers 2
+    python manage.py bench_http http://127.0.0.1:8000/1/results/ --output wsgi.json
+
+    ASYNC_VIEWS=1 gunicorn webvoter.asgi -k uvicorn.workers.UvicornWorker --workers 2
+    python manage.py bench_http http://127.0.0.1:8000/1/results/ --output asgi.json
+
+Requests are sent from a pool of `--concurrency` client threads, so slow
+clients holding connections open are simulated by raising it.
+"""
+import datetime
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+
+def fetch(url: str, timeout: float):
+    """GET `url` and return its status code and latency in seconds."""
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = None
+    return status, time.perf_counter() - t0
+
+
+def bench_url(url: str, num_requests: int, concurrency: int, timeout: float) -> dict:
+    """Send `num_requests` GET requests to `url` and summarize throughput and latency."""
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: fetch(url, timeout), range(num_requests)))
+    elapsed = time.perf_counter() - t0
+
+    statuses = [status for status, _ in results]
+    latency = np.array([t for _, t in results]) * 1000
+    return dict(
+        url=url,
+        requests=num_requests,
+        concurrency=concurrency,
+        errors=sum(1 for s in statuses if s is None or s >= 500),
+        seconds=round(elapsed, 3),
+        requests_per_second=round(num_requests / elapsed, 2),
+        latency_ms={
+            'mean' : round(float(latency.mean()), 2),
+            'p50' : round(float(np.percentile(latency, 50)), 2),
+            'p95' : round(float(np.percentile(latency, 95)), 2),
+            'max' : round(float(latency.max()), 2),
+        },
+    )
+
+
+class Command(BaseCommand):
+    help = 'Measure request throughput and latency of a running webvoter server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Number of requests per URL.')
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help='Number of concurrent clients.')
+        parser.add_argument('--timeout', type=float, default=60.0,
+                            help='Request timeout in seconds.')
+        parser.add_argument('--output', default=None,
+                            help='Path of JSON results file. Written to stdout if not given.')
+
+    def handle(self, *args, **kwargs):
+        records = []
+        for url in kwargs['urls']:
+            record = bench_url(url, kwargs['requests'], kwargs['concurrency'], kwargs['timeout'])
+            self.stderr.write(f"{url}: {record['requests_per_second']} req/s, "
+                              f"p95 {record['latency_ms']['p95']} ms")
+            records.append(record)
+
+        out = dict(
+            date=datetime.datetime.now().isoformat(),
+            results=records,
+        )
+        out = json.dumps(out, indent=1)
+        if kwargs['output'] is None:
+            self.stdout.write(out)
+        else:
+            with open(kwargs['output'], 'w') as f:
+                f.write(out)
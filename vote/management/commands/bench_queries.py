@@ -0,0 +1,78 @@
+"""Show query plans and timings for the hot ballot queries.
+
+Generate a large dataset and compare plans before and after the ballot
+indexes migration with::
+
+    python manage.py migrate vote 0004
+    python manage.py bench_queries --generate
+    python manage.py migrate vote
+    python manage.py bench_queries
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from vote import models
+from vote import voting
+from vote import bulk
+from vote import forms
+
+BENCH_DESCRIPTION = 'bench_queries dataset'
+
+
+def generate(num_elections: int, num_voters: int, num_candidates: int, seed: int=0):
+    """Generate random ranked elections for benchmarking."""
+    rs = np.random.RandomState(seed)
+    etype = voting.get_method_id(voting.NAME_IRV)
+    names = [f'c{jj}' for jj in range(num_candidates)]
+
+    for ii in range(num_elections):
+        election = bulk.create_election(etype, BENCH_DESCRIPTION, names)
+        for start in range(0, num_voters, bulk.CHUNK_SIZE):
+            num = min(bulk.CHUNK_SIZE, num_voters - start)
+            ranks = np.argsort(rs.rand(num, num_candidates), axis=1) + 1
+            ranks = forms.to_form_ranks(ranks)
+            bulk.bulk_create_ballots(election, ranks)
+
+
+def get_queries():
+    """Get dict of the hot ballot and election list querysets."""
+    election = models.Election.objects.filter(description=BENCH_DESCRIPTION).last()
+    voter = election.voter_set.last()
+    queries = {
+        'election ballots' : election.get_ballots().values_list('voter_id', 'candidate_id', 'vote'),
+        'voter of user' : models.Voter.objects.filter(election=election, user=voter.user_id),
+        'voter has voted' : election.get_ballots().filter(voter=voter),
+        'popular elections' : models.Election.objects.order_by('-num_voters')[:20],
+        'latest elections' : models.Election.objects.order_by('-date_published')[:100],
+    }
+    return queries
+
+
+class Command(BaseCommand):
+    help = 'Show query plans and timings for the hot ballot queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', action='store_true',
+                            help='Generate the benchmark dataset first.')
+        parser.add_argument('--elections', type=int, default=20)
+        parser.add_argument('--voters', type=int, default=5000)
+        parser.add_argument('--candidates', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of timed runs per query.')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['generate']:
+            generate(kwargs['elections'], kwargs['voters'], kwargs['candidates'])
+
+        for name, queryset in get_queries().items():
+            self.stdout.write(f'--- {name} ---')
+            self.stdout.write(queryset.explain())
+
+            times = []
+            for _ in range(kwargs['repeat']):
+                t0 = time.perf_counter()
+                list(queryset.all())
+                times.append(time.perf_counter() - t0)
+            self.stdout.write(f'best of {len(times)}: {min(times) * 1000:0.2f} ms\n')
@@ -0,0 +1,155 @@
+"""Benchmark the results pipeline across voter and candidate scales.
+
+For each ballot type and scale, an election is seeded once with spatial
+model ballots and reused on later runs. Every method of the ballot type
+is then post-processed with the results cache bypassed, and these
+phases are timed separately:
+
+- data : ballot data loading in `PostElection`
+- tally : the election method tally in `PostElection`
+- init : the rest of `PostElection` construction
+- plot_* : each plot method used for the election method
+- heatmap : `PostElection.figure_ballot_heatmap`
+- components : Bokeh `components` serialization of all figures
+- render : rendering of the results template
+
+Results are written as JSON so runs can be compared over time.
+"""
+import datetime
+import json
+import sys
+import time
+
+import votesim
+from django.core.management.base import BaseCommand
+from django.template import loader
+from bokeh.embed import components
+
+from vote import models
+from vote import voting
+from vote import bulk
+from vote import timing
+from vote.cache import results_cache
+from vote.forms import RecalculateForm
+from vote.post import PostElection
+from vote.views.results import get_results_context
+from vote.management.commands.gen_data import gen_spatial_ballots
+
+VOTERS = [100, 10000, 100000]
+CANDIDATES = [5, 15, 30]
+
+# Methods used to generate ballots and list of methods run, for each ballot type.
+BALLOT_TYPES = {
+    'single' : (votesim.votemethods.PLURALITY, voting.single_methods),
+    'score' : (votesim.votemethods.SCORE, voting.scored_methods),
+    'rank' : (votesim.votemethods.IRV, voting.ranked_methods),
+}
+
+
+def get_bench_election(ballot_type: str, num_voters: int, num_candidates: int):
+    """Get or seed the benchmark election for a ballot type and scale."""
+    description = f'bench_results {ballot_type} {num_voters}x{num_candidates}'
+    election = models.Election.objects.filter(description=description).first()
+    if election is not None:
+        return election
+
+    etype = BALLOT_TYPES[ballot_type][0]
+    names = [f'Candidate {ii}' for ii in range(num_candidates)]
+    election = bulk.create_election(etype, description, names)
+    candidate_ids = election.get_candidate_ids()
+    for ballot_data in gen_spatial_ballots(etype, num_voters, num_candidates):
+        bulk.bulk_create_ballots(election, ballot_data, candidate_ids=candidate_ids)
+    return election
+
+
+def timed(func, *args):
+    """Call `func` and return its result and run time in seconds."""
+    t0 = time.perf_counter()
+    out = func(*args)
+    return out, time.perf_counter() - t0
+
+
+def bench_method(election: models.Election, etype: str) -> dict:
+    """Time each results phase for an election method."""
+    results_cache().clear()
+    # Data and tally phases are timed inside a single construction.
+    with timing.recording() as timings:
+        post, t_init = timed(PostElection, election.pk, etype)
+    phases = {}
+    for name in ('data', 'tally'):
+        phases[name] = timings.durations.get(name, 0.0)
+    phases['init'] = t_init - phases['data'] - phases['tally']
+    if post.error_on_run:
+        return dict(error=post.output.get('error', ''), phases=phases)
+
+    figures = []
+    for name in post.get_plot_names():
+        figure, phases[name] = timed(getattr(post, name))
+        figures.append(figure)
+    figure, phases['heatmap'] = timed(post.figure_ballot_heatmap)
+    figures.append(figure)
+    _, phases['components'] = timed(components, figures)
+
+    form = RecalculateForm(election, initial={'etype' : etype, 'numwinners' : post.numwinners})
+    context = get_results_context(post, form)
+    _, phases['render'] = timed(loader.render_to_string, 'vote/results.html', context)
+    return dict(error=None, phases=phases)
+
+
+def build(voters=VOTERS, candidates=CANDIDATES, ballot_types=BALLOT_TYPES, progress=None):
+    """Run the benchmark and return a list of result records."""
+    records = []
+    for ballot_type in ballot_types:
+        methods = BALLOT_TYPES[ballot_type][1]
+        for num_voters in voters:
+            for num_candidates in candidates:
+                election = get_bench_election(ballot_type, num_voters, num_candidates)
+                for method_name, etype in methods.items():
+                    record = dict(
+                        ballot_type=ballot_type,
+                        voters=num_voters,
+                        candidates=num_candidates,
+                        etype=etype,
+                        method=method_name,
+                    )
+                    record.update(bench_method(election, etype))
+                    records.append(record)
+                    if progress is not None:
+                        progress(record)
+    return records
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the results pipeline across voter and candidate scales'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, nargs='+', default=VOTERS)
+        parser.add_argument('--candidates', type=int, nargs='+', default=CANDIDATES)
+        parser.add_argument('--ballot-types', nargs='+', default=list(BALLOT_TYPES),
+                            choices=list(BALLOT_TYPES))
+        parser.add_argument('--output', default=None,
+                            help='Path of JSON results file. Written to stdout if not given.')
+
+    def handle(self, *args, **kwargs):
+        def progress(record):
+            total = sum(record['phases'].values())
+            sys.stderr.write(
+                f"{record['ballot_type']} {record['voters']}x{record['candidates']} "
+                f"{record['etype']}: {total:0.3f} s\n")
+
+        records = build(
+            voters=kwargs['voters'],
+            candidates=kwargs['candidates'],
+            ballot_types=kwargs['ballot_types'],
+            progress=progress,
+        )
+        out = dict(
+            date=datetime.datetime.now().isoformat(),
+            results=records,
+        )
+        out = json.dumps(out, indent=1)
+        if kwargs['output'] is None:
+            self.stdout.write(out)
+        else:
+            with open(kwargs['output'], 'w') as f:
+                f.write(out)
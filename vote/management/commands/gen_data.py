@@ -1,7 +1,11 @@
 """Create fake user election data."""
+import time
+
 import numpy as np
 from vote import models
 from vote import voting
+from vote import bulk
+from vote import forms
 import votesim
 from votesim.models import spatial
 from django.core.management.base import BaseCommand
@@ -155,11 +159,102 @@ def build():
     return
 
 
+def gen_spatial_ballots(etype: str, num_voters: int, num_candidates: int,
+                        chunk_size: int=bulk.CHUNK_SIZE, seed: int=0):
+    """Generate spatial model ballots in chunks of voters.
+
+    Candidates are drawn once, and every chunk of voters is sampled from
+    the same voter distribution and votes on those same candidates, so the
+    chunks form one election of `num_voters` voters. Elections generated
+    with different `seed` get independent voter samples. Ranked ballots
+    use the RankForm convention (worst rank 0), like submitted ballots.
+
+    Yields
+    ------
+    ballots : array shape (a, num_candidates)
+        Ballots for `a` <= `chunk_size` voters.
+    """
+    candidates = None
+    for ii, start in enumerate(range(0, num_voters, chunk_size)):
+        numvoters = min(chunk_size, num_voters - start)
+        # Derive the chunk seed from both seeds, so chunks of elections
+        # generated with different seeds never share voter samples.
+        chunk_seed = int(np.random.SeedSequence([seed, ii]).generate_state(1)[0])
+        v = spatial.Voters(seed=chunk_seed,)
+        v.add_random(numvoters=numvoters, ndim=2, )
+        if candidates is None:
+            candidates = spatial.Candidates(voters=v, seed=seed)
+            candidates.add_random(cnum=num_candidates, sdev=1.0)
+        e = spatial.Election(voters=v, candidates=candidates)
+        ballot_data, _ = e.ballotgen.get_ballots(etype=etype, strategies=(),)
+        if voting.get_ballot_type_id(etype) == voting.ID_RANK:
+            ballot_data = forms.to_form_ranks(ballot_data)
+        yield ballot_data
+
+
+def build_bulk(num_elections: int, num_voters: int, num_candidates: int, etype: str,
+               chunk_size: int=bulk.CHUNK_SIZE, progress=None):
+    """Generate large elections with bulk inserts, for load testing.
+
+    Parameters
+    ----------
+    progress : callable or None
+        Called as `progress(election, num_voters_done)` after each chunk.
+    """
+    names = [f'Candidate {ii}' for ii in range(num_candidates)]
+    elections = []
+    for ii in range(num_elections):
+        description = f'generated {etype}: {num_voters} voters, {num_candidates} candidates #{ii}'
+        election = bulk.create_election(etype, description, names)
+        candidate_ids = election.get_candidate_ids()
+
+        num_done = 0
+        chunks = gen_spatial_ballots(etype, num_voters, num_candidates, chunk_size, seed=ii)
+        for ballot_data in chunks:
+            num_done += bulk.bulk_create_ballots(election, ballot_data, candidate_ids=candidate_ids)
+            if progress is not None:
+                progress(election, num_done)
+        elections.append(election)
+    return elections
+
+
 class Command(BaseCommand):
     help = 'Create fake election data with bots'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--elections', type=int, default=None,
+            help='Number of large elections to generate with bulk inserts. '
+                 'Without this option only the demo elections are created.',
+        )
+        parser.add_argument('--voters', type=int, default=10000)
+        parser.add_argument('--candidates', type=int, default=10)
+        parser.add_argument(
+            '--method', default=votesim.votemethods.IRV,
+            choices=voting.all_method_ids,
+            help='Election method, which also sets the ballot type.',
+        )
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE)
+
     def handle(self, *args, **kwargs):
-        build()
+        if kwargs['elections'] is None:
+            build()
+            return
+
+        t0 = time.perf_counter()
+
+        def progress(election, num_done):
+            dt = time.perf_counter() - t0
+            self.stdout.write(f'Election {election.pk}: {num_done} voters ({dt:0.1f} s)')
+
+        build_bulk(
+            num_elections=kwargs['elections'],
+            num_voters=kwargs['voters'],
+            num_candidates=kwargs['candidates'],
+            etype=kwargs['method'],
+            chunk_size=kwargs['chunk_size'],
+            progress=progress,
+        )
 
 
 
@@ -0,0 +1,133 @@
+"""Import ballots into an election from a CSV or NumPy file.
+
+CSV files have a header row naming the candidate columns, as written by
+the `/<election_id>/ballots.csv` export. A `voter` column is ignored.
+NumPy `.npy` files hold a voter x candidate matrix with columns ordered
+by candidate id. Rank ballots use 1 for the top rank and 0 for the
+worst, and single vote ballots mark the chosen candidate with 1.
+
+Files are read and validated in chunks, and each chunk of ballots is
+written in one transaction. Unless --skip-invalid is given, the whole
+file is validated before anything is written.
+"""
+import csv
+import time
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from vote import bulk
+from vote import export
+from vote.forms import validate_ballot_matrix
+from vote.models import Election
+
+# Max number of invalid ballots listed when the import is aborted.
+MAX_ERRORS_SHOWN = 20
+
+
+def read_csv_chunks(path: str, columns: list, chunk_size: int):
+    """Yield (row number, ballot array) chunks of a CSV ballot file.
+
+    Parameters
+    ----------
+    path : str
+    columns : list[str]
+        Names of candidate columns, in candidate id order.
+    chunk_size : int
+        Number of ballots per chunk.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        missing = [name for name in columns if name not in header]
+        if missing:
+            raise CommandError(f'Missing candidate columns: {", ".join(missing)}')
+        index = [header.index(name) for name in columns]
+
+        def to_array(start, rows):
+            try:
+                return start, np.array(rows, dtype=float)
+            except ValueError:
+                raise CommandError(f'Non-numeric vote in rows {start} to {start + len(rows) - 1}.')
+
+        start = 1
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            if len(row) < len(header):
+                raise CommandError(f'Row {start + len(rows)} has missing values.')
+            rows.append([row[ii] for ii in index])
+            if len(rows) >= chunk_size:
+                yield to_array(start, rows)
+                start += len(rows)
+                rows = []
+        if rows:
+            yield to_array(start, rows)
+
+
+def read_npy_chunks(path: str, num_candidates: int, chunk_size: int):
+    """Yield (row number, ballot array) chunks of a NumPy ballot file."""
+    data = np.load(path, mmap_mode='r')
+    if data.ndim != 2 or data.shape[1] != num_candidates:
+        raise CommandError(f'Expected ballot array with {num_candidates} columns, got shape {data.shape}.')
+    for start in range(0, len(data), chunk_size):
+        yield start + 1, np.asarray(data[start : start + chunk_size], dtype=float)
+
+
+class Command(BaseCommand):
+    help = 'Import ballots into an election from a CSV or NumPy file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('election_id', type=int)
+        parser.add_argument('path', help='Path of .csv or .npy ballot file.')
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE,
+                            help='Number of ballots read, validated and written at once.')
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help='Import valid ballots and skip invalid ones, '
+                                 'instead of aborting if any ballot is invalid.')
+
+    def handle(self, *args, **kwargs):
+        try:
+            election = Election.objects.get(pk=kwargs['election_id'])
+        except Election.DoesNotExist:
+            raise CommandError(f'Election {kwargs["election_id"]} does not exist.')
+        path = kwargs['path']
+        chunk_size = kwargs['chunk_size']
+        candidate_ids = election.get_candidate_ids()
+
+        def chunks():
+            if Path(path).suffix == '.npy':
+                return read_npy_chunks(path, len(candidate_ids), chunk_size)
+            columns = export.get_column_names(election, candidate_ids)[1:]
+            return read_csv_chunks(path, columns, chunk_size)
+
+        if not kwargs['skip_invalid']:
+            num_invalid = 0
+            for start, data in chunks():
+                errors = validate_ballot_matrix(data, election.ballot_type)
+                for ii in np.flatnonzero(errors != ''):
+                    if num_invalid < MAX_ERRORS_SHOWN:
+                        self.stderr.write(f'Row {start + ii}: {errors[ii]}')
+                    num_invalid += 1
+            if num_invalid:
+                raise CommandError(f'{num_invalid} invalid ballots, nothing was imported. '
+                                   'Use --skip-invalid to import the valid ballots only.')
+
+        t0 = time.perf_counter()
+        num_imported = 0
+        num_skipped = 0
+        for start, data in chunks():
+            valid = validate_ballot_matrix(data, election.ballot_type) == ''
+            num_skipped += int(np.sum(~valid))
+            num_imported += bulk.bulk_create_ballots(
+                election, data[valid], candidate_ids=candidate_ids)
+            dt = time.perf_counter() - t0
+            self.stdout.write(f'{num_imported} ballots imported ({dt:0.1f} s)')
+
+        dt = time.perf_counter() - t0
+        rate = num_imported / dt if dt > 0 else 0
+        self.stdout.write(
+            f'Imported {num_imported} ballots into election {election.pk}, '
+            f'skipped {num_skipped} invalid, in {dt:0.1f} s ({rate:0.0f} ballots/s).')
@@ -0,0 +1,27 @@
+"""Rebuild persisted ballot matrices from the ballot tables."""
+from vote import models
+from django.core.management.base import BaseCommand
+
+
+def build(election_ids=None):
+    elections = models.Election.objects.all()
+    if election_ids:
+        elections = elections.filter(pk__in=election_ids)
+
+    for election in elections.iterator():
+        election.rebuild_ballot_matrix()
+        yield election
+
+
+class Command(BaseCommand):
+    help = 'Rebuild persisted voter x candidate ballot matrices from the ballot tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'election_ids', nargs='*', type=int,
+            help='Election ids to rebuild. Rebuild all elections if not given.',
+        )
+
+    def handle(self, *args, **kwargs):
+        for election in build(kwargs['election_ids']):
+            self.stdout.write(f'Rebuilt ballot matrix for election {election.pk}')
@@ -0,0 +1,33 @@
+"""Recount election voters from the ballot tables and fix any drift."""
+from vote import models
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Recount election voters from the ballot tables and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start', type=int, default=None,
+            help='First election id to recount.',
+        )
+        parser.add_argument(
+            '--stop', type=int, default=None,
+            help='Recount elections with ids below this value.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of elections locked and written per update.',
+        )
+
+    def handle(self, *args, **kwargs):
+        def progress(num_done, num_updated):
+            self.stdout.write(f'Recounted {num_done} elections, fixed {num_updated}.')
+
+        num_updated = models.Election.update_all(
+            start=kwargs['start'],
+            stop=kwargs['stop'],
+            batch_size=kwargs['batch_size'],
+            progress=progress,
+        )
+        self.stdout.write(f'Fixed {num_updated} elections.')
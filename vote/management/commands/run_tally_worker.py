@@ -0,0 +1,47 @@
+"""Run background tally jobs."""
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from vote import jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run background tally jobs for expensive election methods'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no jobs are pending.')
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help='Seconds to wait between polls when no jobs are pending.')
+        parser.add_argument('--stale-after', type=float, default=600.0,
+                            help='Retry running jobs started more than this many seconds ago.')
+
+    def handle(self, *args, **kwargs):
+        while True:
+            close_old_connections()
+            num = jobs.requeue_stale_jobs(kwargs['stale_after'])
+            if num:
+                self.stdout.write(f'Retried {num} stale jobs.')
+
+            job = jobs.claim_job()
+            if job is None:
+                if kwargs['once']:
+                    return
+                time.sleep(kwargs['poll'])
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                jobs.run_job(job)
+            except Exception as e:
+                logger.exception('Tally job %s failed.', job)
+                self.stderr.write(f'Job {job.pk} failed: {e}')
+                jobs.retry_job(job, 'Calculation failed.')
+                continue
+            dt = time.perf_counter() - t0
+            self.stdout.write(f'Finished job {job}: {dt:0.2f} s')
@@ -0,0 +1,67 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from vote import timing
+
+logger = logging.getLogger(__name__)
+
+
+class ServerTimingMiddleware:
+    """Expose per-request phase timings and database query counts as
+    `Server-Timing` response headers.
+
+    Enabled with the SERVER_TIMING setting. Set SERVER_TIMING_LOG to also
+    write one structured log line per request. When disabled, the
+    middleware removes itself from the request chain.
+
+    The middleware supports both sync and async requests, so it does not
+    force async views to run in a sync thread under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SERVER_TIMING', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.log = getattr(settings, 'SERVER_TIMING_LOG', False)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        timing.enable_query_timing()
+
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        t0 = time.perf_counter()
+        with timing.recording() as timings:
+            response = self.get_response(request)
+        return self.process_timings(request, response, timings, t0)
+
+
+    async def __acall__(self, request):
+        t0 = time.perf_counter()
+        with timing.recording() as timings:
+            response = await self.get_response(request)
+        return self.process_timings(request, response, timings, t0)
+
+
+    def process_timings(self, request, response, timings, t0: float):
+        """Add the timings header to `response`, and log the timings."""
+        timings.add('total', time.perf_counter() - t0)
+        response['Server-Timing'] = timings.server_timing()
+        if self.log:
+            line = {
+                'path' : request.path,
+                'method' : request.method,
+                'status' : response.status_code,
+                'timings' : timings.to_dict(),
+            }
+            logger.info(json.dumps(line))
+        return response
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vote', '0002_election_num_voters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BallotBlock',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('index', models.PositiveIntegerField(verbose_name='Block index')),
+                ('num_rows', models.PositiveIntegerField(default=0, verbose_name='# of ballot rows')),
+                ('data', models.BinaryField(default=b'', verbose_name='Ballot rows')),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='vote.election')),
+            ],
+            options={
+                'unique_together': {('election', 'index')},
+            },
+        ),
+    ]
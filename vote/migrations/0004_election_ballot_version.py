@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vote', '0003_ballotblock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='election',
+            name='ballot_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Ballot version'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vote', '0004_election_ballot_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='election',
+            index=models.Index(fields=['-num_voters'], name='vote_electi_num_vot_2263c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='election',
+            index=models.Index(fields=['-date_published'], name='vote_electi_date_pu_df041c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rankballot',
+            index=models.Index(fields=['election', 'voter', 'candidate', 'vote'], name='rankballot_election_voter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voteballot',
+            index=models.Index(fields=['election', 'voter', 'candidate', 'vote'], name='voteballot_election_voter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voter',
+            index=models.Index(fields=['election', 'user'], name='vote_voter_electio_93158f_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vote', '0005_ballot_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TallyJob',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('etype', models.CharField(max_length=20, verbose_name='Election method')),
+                ('numwinners', models.PositiveSmallIntegerField(verbose_name='# of winners')),
+                ('ballot_version', models.PositiveIntegerField(verbose_name='Ballot version')),
+                ('status', models.SmallIntegerField(choices=[(0, 'pending'), (1, 'running'), (2, 'done')], default=0, verbose_name='Status')),
+                ('result', models.BinaryField(null=True, verbose_name='Tally result')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_started', models.DateTimeField(null=True)),
+                ('date_finished', models.DateTimeField(null=True)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='vote.election')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['election', 'etype', 'numwinners', 'ballot_version'], name='vote_tallyj_electio_b28014_idx'), models.Index(fields=['status', 'id'], name='vote_tallyj_status_13227c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vote', '0006_tallyjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairwiseMatrix',
+            fields=[
+                ('election', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='vote.election')),
+                ('num_rows', models.PositiveIntegerField(default=0, verbose_name='# of ballots counted')),
+                ('data', models.BinaryField(default=b'', verbose_name='Pairwise counts')),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:00
+
+from django.db import migrations, models
+
+
+def delete_duplicate_jobs(apps, schema_editor):
+    """Keep the first job of each election method and ballot version."""
+    TallyJob = apps.get_model('vote', 'TallyJob')
+    rows = TallyJob.objects.order_by('id').values_list(
+        'id', 'election_id', 'etype', 'numwinners', 'ballot_version')
+    seen = set()
+    duplicates = []
+    for pk, *key in rows:
+        key = tuple(key)
+        if key in seen:
+            duplicates.append(pk)
+        seen.add(key)
+    TallyJob.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vote', '0007_pairwisematrix'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_jobs, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='tallyjob',
+            name='vote_tallyj_electio_b28014_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='tallyjob',
+            constraint=models.UniqueConstraint(fields=('election', 'etype', 'numwinners', 'ballot_version'), name='unique_tally_job'),
+        ),
+    ]
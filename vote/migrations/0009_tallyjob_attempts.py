@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vote', '0008_tallyjob_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tallyjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='# of attempts'),
+        ),
+        migrations.AddField(
+            model_name='tallyjob',
+            name='date_retry',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='tallyjob',
+            name='status',
+            field=models.SmallIntegerField(choices=[(0, 'pending'), (1, 'running'), (2, 'done'), (3, 'failed')], default=0, verbose_name='Status'),
+        ),
+    ]
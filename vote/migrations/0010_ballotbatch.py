@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vote', '0009_tallyjob_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BallotBatch',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('batch_id', models.CharField(max_length=100, verbose_name='Client batch id')),
+                ('response', models.JSONField(verbose_name='API response')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='vote.election')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('election', 'batch_id'), name='unique_ballot_batch')],
+            },
+        ),
+    ]
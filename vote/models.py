@@ -1,10 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 
 import numpy as np
 from vote import voting
+from vote.tally import pairwise_counts
 
 
 # Create your models here.
@@ -21,12 +26,37 @@ CANDIDATE_NUM_MAX = 30
 WINNER_NUM_MAX = CANDIDATE_NUM_MAX - 1
 SCORE_MAX = 5
 
+# Persisted ballot matrix storage settings
+BALLOT_DTYPE = np.int16
+BALLOT_BLOCK_ROWS = 1024
+PAIRWISE_DTYPE = np.int32
+
 # Default user name
 USER_ANONYMOUS = 'anonymous'
 
+# Anonymous user memoized per process by `get_default_user`.
+_default_user = None
+
+
 def get_default_user():
-    """Retrieve default anonymous user."""
-    return  get_user_model().objects.get_or_create(username=USER_ANONYMOUS)[0]
+    """Retrieve default anonymous user.
+    The user is looked up once per process and memoized."""
+    global _default_user
+    if _default_user is None:
+        _default_user = get_user_model().objects.get_or_create(username=USER_ANONYMOUS)[0]
+    return _default_user
+
+
+def clear_default_user():
+    """Forget the memoized anonymous user, so it is looked up again on next use."""
+    global _default_user
+    _default_user = None
+
+
+@receiver(post_delete, sender=User)
+def _clear_deleted_default_user(sender, instance, **kwargs):
+    if _default_user is not None and instance.pk == _default_user.pk:
+        clear_default_user()
 
 
 def get_or_create_user(name:str):
@@ -73,9 +103,21 @@ class Election(models.Model):
         default = 0,
     )
 
+    ballot_version = models.PositiveIntegerField(
+        'Ballot version',
+        default = 0,
+    )
+
     description = models.CharField('Poll question', max_length=200)
     date_published = models.DateField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Election list view orderings
+            models.Index(fields=['-num_voters']),
+            models.Index(fields=['-date_published']),
+        ]
+
     def save(self, *args, **kwargs):
         self.ballot_type = voting.get_ballot_type_id(self.etype)
         super().save(*args, **kwargs)
@@ -108,27 +150,110 @@ class Election(models.Model):
 
     def get_voter_num(self):
         """get number of voters found for election."""
-        ballots = self.get_ballot_set().all()
-        ballots_voter_ids = [b.voter.id for b in ballots]
-        return len(np.unique(ballots_voter_ids))
+        return self.get_ballots().values('voter_id').distinct().count()
 
 
     def update_voter_num(self):
+        """Recount number of voters from the ballot tables."""
         num = self.get_voter_num()
         self.num_voters = num
-        self.save()
+        self.save(update_fields=['num_voters'])
         return
 
 
-    @staticmethod
-    def update_all():
-        """Update all election voters."""
-        elections = Election.objects.all()
-        for election in elections:
-            election.update_voter_num()
+    def record_ballot(self, new_voter: bool):
+        """Atomically bump ballot version after a ballot is cast,
+        and add to the voter count if the ballot is from a new voter."""
+        return self.record_ballots(int(new_voter))
+
+
+    def record_ballots(self, num_new_voters: int):
+        """Atomically bump ballot version after ballots are cast,
+        and add `num_new_voters` to the voter count."""
+        updates = {'ballot_version' : F('ballot_version') + 1}
+        if num_new_voters:
+            updates['num_voters'] = F('num_voters') + num_new_voters
+            self.num_voters += num_new_voters
+        Election.objects.filter(pk=self.pk).update(**updates)
+        self.ballot_version += 1
+        return
+
+
+    def invalidate_results(self):
+        """Bump ballot version so that cached results are no longer used."""
+        Election.objects.filter(pk=self.pk).update(ballot_version=F('ballot_version') + 1)
+        self.refresh_from_db(fields=['ballot_version'])
         return
 
 
+    @staticmethod
+    def update_all(start: int=None, stop: int=None, batch_size: int=1000, progress=None):
+        """Recount voters of all elections using aggregate subqueries.
+
+        Parameters
+        ----------
+        start, stop : int or None
+            Optional election id range [start, stop) to recount.
+        batch_size : int
+            Number of elections locked and written per update.
+        progress : callable or None
+            Called as `progress(num_done, num_updated)` after each batch.
+
+        Returns
+        -------
+        num_updated : int
+            Number of elections whose voter count changed.
+        """
+        elections = Election.objects.order_by('id')
+        if start is not None:
+            elections = elections.filter(id__gte=start)
+        if stop is not None:
+            elections = elections.filter(id__lt=stop)
+
+        # Distinct voters of each election, for both ballot tables.
+        num_voters = Value(0)
+        for ballot_model in (VoteBallot, RankBallot):
+            ballots = ballot_model.objects.filter(election=OuterRef('pk')).order_by()
+            ballots = ballots.values('election').annotate(n=Count('voter', distinct=True))
+            num_voters = num_voters + Coalesce(Subquery(ballots.values('n')), 0)
+
+        num_done = 0
+        num_updated = 0
+        election_ids = elections.values_list('id', flat=True)
+        batch = []
+        for election_id in election_ids.iterator(chunk_size=batch_size):
+            batch.append(election_id)
+            if len(batch) == batch_size:
+                num_updated += Election._update_voter_nums(batch, num_voters)
+                num_done += len(batch)
+                batch = []
+                if progress is not None:
+                    progress(num_done, num_updated)
+
+        num_updated += Election._update_voter_nums(batch, num_voters)
+        num_done += len(batch)
+        if progress is not None:
+            progress(num_done, num_updated)
+        return num_updated
+
+
+    @staticmethod
+    def _update_voter_nums(election_ids: list, num_voters) -> int:
+        """Set voter counts of elections to `num_voters` in one UPDATE.
+
+        The election rows are locked first, so writers incrementing
+        `num_voters` with their new ballots either commit before the
+        ballots are counted, or increment after the recount.
+        """
+        if not election_ids:
+            return 0
+        with transaction.atomic():
+            elections = Election.objects.select_for_update().filter(id__in=election_ids)
+            list(elections.values_list('pk'))
+            elections = Election.objects.filter(id__in=election_ids).annotate(n=num_voters)
+            return elections.exclude(num_voters=F('n')).update(num_voters=num_voters)
+
+
     # def user_ballots(self, user):
     #     """get all ballots a user has cast in this election."""
     #     ballots = self.get_ballots().
@@ -150,6 +275,216 @@ class Election(models.Model):
             return self.rankballot_set.all()
 
 
+    def get_candidate_ids(self):
+        """Get id's of all candidates, sorted."""
+        return list(self.candidate_set.order_by('id').values_list('id', flat=True))
+
+
+    def load_ballot_matrix(self, candidate_ids=None) -> np.ndarray:
+        """Build voter x candidate ballot matrix from the ballot tables.
+
+        Ballots are pulled as flat (voter_id, candidate_id, vote) columns
+        with a single query, without building any model instances.
+        Columns are ordered by candidate id.
+        """
+        if candidate_ids is None:
+            candidate_ids = self.get_candidate_ids()
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        candidate_num = len(candidate_ids)
+
+        # Get all votes as columns
+        ballots = self.get_ballots().values_list('voter_id', 'candidate_id', 'vote')
+        ballots = np.array(list(ballots), dtype=np.int64).reshape(-1, 3)
+        ballots_voter_ids = ballots[:, 0]
+        ballots_candidate_ids = ballots[:, 1]
+        ballots_votes = ballots[:, 2]
+
+        # Get unique voters
+        ballots_voter_ids_unique, inv_index = np.unique(ballots_voter_ids, return_inverse=True)
+
+        # Candidate ids are sorted, so the array index is found by binary search.
+        candidate_id_index = np.searchsorted(candidate_ids, ballots_candidate_ids)
+
+        voter_num = len(ballots_voter_ids_unique)
+        data = np.zeros((voter_num, candidate_num), dtype=BALLOT_DTYPE)
+        data[inv_index, candidate_id_index] = ballots_votes
+        return data
+
+
+    def get_ballot_matrix(self, candidate_ids=None) -> np.ndarray:
+        """Read the persisted voter x candidate ballot matrix.
+
+        The matrix is rebuilt from the ballot tables if it is missing or its
+        number of rows has drifted from `num_voters`, for example after a
+        voter changes their ballot.
+        """
+        if candidate_ids is None:
+            candidate_ids = self.get_candidate_ids()
+
+        data = self._read_ballot_blocks(len(candidate_ids))
+        if len(data) != self.num_voters:
+            return self.rebuild_ballot_matrix(candidate_ids, force=False)
+        return data
+
+
+    def _read_ballot_blocks(self, candidate_num: int) -> np.ndarray:
+        """Concatenate the persisted ballot blocks."""
+        blocks = self.ballotblock_set.order_by('index').values_list('data', flat=True)
+        data = b''.join(bytes(b) for b in blocks)
+        data = np.frombuffer(data, dtype=BALLOT_DTYPE)
+        return data.reshape(-1, candidate_num)
+
+
+    def rebuild_ballot_matrix(self, candidate_ids=None, force: bool=True) -> np.ndarray:
+        """Rebuild persisted ballot matrix from the ballot tables.
+
+        Parameters
+        ----------
+        candidate_ids : list[int] or None
+        force : bool
+            If False, only rebuild if the matrix has still drifted from
+            `num_voters` once the election is locked. Another request may
+            have rebuilt it or appended to it in the meantime.
+        """
+        if candidate_ids is None:
+            candidate_ids = self.get_candidate_ids()
+
+        with transaction.atomic():
+            # Lock the election row so rebuilds and appends are serialized,
+            # and count voters as of the lock.
+            elections = Election.objects.select_for_update().values_list('num_voters', flat=True)
+            self.num_voters = elections.get(pk=self.pk)
+            if not force:
+                data = self._read_ballot_blocks(len(candidate_ids))
+                if len(data) == self.num_voters:
+                    return data
+
+            data = self.load_ballot_matrix(candidate_ids)
+            blocks = []
+            for ii, start in enumerate(range(0, len(data), BALLOT_BLOCK_ROWS)):
+                rows = data[start : start + BALLOT_BLOCK_ROWS]
+                block = BallotBlock(
+                    election=self,
+                    index=ii,
+                    num_rows=len(rows),
+                    data=rows.tobytes(),
+                )
+                blocks.append(block)
+
+            self.ballotblock_set.all().delete()
+            BallotBlock.objects.bulk_create(blocks)
+            PairwiseMatrix.objects.filter(election=self).delete()
+            self.invalidate_results()
+        return data
+
+
+    def get_pairwise_matrix(self, candidate_ids=None) -> np.ndarray:
+        """Read the persisted head-to-head matrix of the ballots.
+
+        Entry [i, j] is the number of voters preferring candidate i to j,
+        ordered by candidate id. The matrix is rebuilt from the ballot
+        matrix if it is missing or has drifted from `num_voters`.
+        """
+        if candidate_ids is None:
+            candidate_ids = self.get_candidate_ids()
+
+        row = PairwiseMatrix.objects.filter(election=self).values_list('data', 'num_rows').first()
+        if row is None or row[1] != self.num_voters:
+            return self.rebuild_pairwise_matrix(candidate_ids, force=False)
+        return self._read_pairwise_matrix(row[0], len(candidate_ids))
+
+
+    @staticmethod
+    def _read_pairwise_matrix(data: bytes, candidate_num: int) -> np.ndarray:
+        matrix = np.frombuffer(bytes(data), dtype=PAIRWISE_DTYPE)
+        return matrix.reshape(candidate_num, candidate_num)
+
+
+    def rebuild_pairwise_matrix(self, candidate_ids=None, force: bool=True) -> np.ndarray:
+        """Rebuild persisted head-to-head matrix from the ballot matrix.
+
+        Parameters
+        ----------
+        candidate_ids : list[int] or None
+        force : bool
+            If False, only rebuild if the matrix is still missing or has
+            drifted from `num_voters` once the election is locked.
+        """
+        if candidate_ids is None:
+            candidate_ids = self.get_candidate_ids()
+
+        with transaction.atomic():
+            # Lock the election row so appends cannot update the matrix
+            # between reading the ballots and saving the rebuilt counts.
+            elections = Election.objects.select_for_update().values_list('num_voters', flat=True)
+            self.num_voters = elections.get(pk=self.pk)
+            if not force:
+                row = PairwiseMatrix.objects.filter(election=self).values_list('data', 'num_rows').first()
+                if row is not None and row[1] == self.num_voters:
+                    return self._read_pairwise_matrix(row[0], len(candidate_ids))
+
+            data = self.get_ballot_matrix(candidate_ids)
+            matrix = pairwise_counts(data, ranked=self.ballot_type == voting.ID_RANK)
+            matrix = matrix.astype(PAIRWISE_DTYPE)
+            PairwiseMatrix.objects.update_or_create(
+                election=self,
+                defaults={'num_rows' : len(data), 'data' : matrix.tobytes()},
+            )
+        return matrix
+
+
+    def append_ballot(self, candidate_votes: dict):
+        """Append one voter's ballot to the persisted ballot matrix.
+
+        Parameters
+        ----------
+        candidate_votes : dict
+            Map of candidate id to vote value.
+        """
+        row = [candidate_votes[k] for k in sorted(candidate_votes)]
+        self.append_ballots(np.asarray([row]))
+        return
+
+
+    def append_ballots(self, data: np.ndarray):
+        """Append rows of voter ballots to the persisted ballot matrix.
+
+        Parameters
+        ----------
+        data : array shape (a, b)
+            Ballots for `a` voters and `b` candidates, columns ordered by candidate id.
+        """
+        data = np.asarray(data, dtype=BALLOT_DTYPE)
+
+        with transaction.atomic(savepoint=False):
+            # Lock the election row to serialize appends.
+            Election.objects.select_for_update().values_list('pk').get(pk=self.pk)
+            block = self.ballotblock_set.select_for_update().order_by('-index').first()
+            if block is None:
+                block = BallotBlock(election=self, index=0, num_rows=0, data=b'')
+
+            start = 0
+            while start < len(data):
+                if block.num_rows >= BALLOT_BLOCK_ROWS:
+                    block = BallotBlock(election=self, index=block.index + 1, num_rows=0, data=b'')
+                rows = data[start : start + BALLOT_BLOCK_ROWS - block.num_rows]
+                block.data = bytes(block.data) + rows.tobytes()
+                block.num_rows += len(rows)
+                block.save()
+                start += len(rows)
+
+            # Update the head-to-head matrix if it has been built.
+            pairwise = PairwiseMatrix.objects.select_for_update().filter(election=self).first()
+            if pairwise is not None:
+                counts = pairwise_counts(data, ranked=self.ballot_type == voting.ID_RANK)
+                matrix = np.frombuffer(bytes(pairwise.data), dtype=PAIRWISE_DTYPE)
+                matrix = matrix + counts.ravel().astype(PAIRWISE_DTYPE)
+                pairwise.data = matrix.tobytes()
+                pairwise.num_rows += len(data)
+                pairwise.save()
+        return
+
+
 
 
 class Candidate(models.Model):
@@ -162,6 +497,42 @@ class Candidate(models.Model):
         return 'Elect.' + str(self.election.id) + '-' + self.name
 
 
+class BallotBlock(models.Model):
+    """Block of rows of an election's persisted voter x candidate ballot matrix.
+
+    Rows are stored as raw `BALLOT_DTYPE` bytes with columns ordered by
+    candidate id. The full matrix is the concatenation of all blocks,
+    so appending a ballot only rewrites the last block.
+    """
+    id = models.AutoField(primary_key=True)
+    election = models.ForeignKey(Election, on_delete=models.CASCADE)
+    index = models.PositiveIntegerField('Block index')
+    num_rows = models.PositiveIntegerField('# of ballot rows', default=0)
+    data = models.BinaryField('Ballot rows', default=b'')
+
+    class Meta:
+        unique_together = [('election', 'index')]
+
+
+    def __str__(self):
+        return 'Elec.' + str(self.election_id) + '-block-' + str(self.index)
+
+
+class PairwiseMatrix(models.Model):
+    """Head-to-head preference counts of an election's ballots.
+
+    Stored as a raw `PAIRWISE_DTYPE` candidate x candidate matrix ordered
+    by candidate id, and updated as ballots are appended to the ballot matrix.
+    """
+    election = models.OneToOneField(Election, on_delete=models.CASCADE, primary_key=True)
+    num_rows = models.PositiveIntegerField('# of ballots counted', default=0)
+    data = models.BinaryField('Pairwise counts', default=b'')
+
+
+    def __str__(self):
+        return 'Elec.' + str(self.election_id) + '-pairwise'
+
+
 class Voter(models.Model):
 
     id = models.AutoField(primary_key=True)
@@ -175,6 +546,11 @@ class Voter(models.Model):
 
     election = models.ForeignKey(Election, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['election', 'user']),
+        ]
+
 
     def __str__(self):
         if self.user.username == USER_ANONYMOUS:
@@ -189,6 +565,15 @@ class VoteBallot(models.Model):
     voter = models.ForeignKey(Voter, on_delete=models.CASCADE)
     vote = models.BooleanField('Candidate vote marking',)
 
+    class Meta:
+        indexes = [
+            # Vote is included so loading an election's ballots reads only the index.
+            models.Index(
+                fields=['election', 'voter', 'candidate', 'vote'],
+                name='voteballot_election_voter_idx',
+            ),
+        ]
+
 
     def __str__(self):
         return str(self.candidate.name) + '-' + str(self.voter)
@@ -201,23 +586,107 @@ class RankBallot(models.Model):
     voter = models.ForeignKey(Voter, on_delete=models.CASCADE)
     vote = models.IntegerField('Candidate ranking')
 
+    class Meta:
+        indexes = [
+            # Vote is included so loading an election's ballots reads only the index.
+            models.Index(
+                fields=['election', 'voter', 'candidate', 'vote'],
+                name='rankballot_election_voter_idx',
+            ),
+        ]
+
 
     def __str__(self):
         return str(self.candidate.name) + '-' + str(self.voter)
 
 
 
-def get_or_create_voter(election: Election, user: User) -> Voter:
-    """Get or create a voter given an election and user.
-    Handles anonymous voters."""
+class TallyJob(models.Model):
+    """Background tally of an election method at a ballot version.
+    Jobs are run by the `run_tally_worker` management command."""
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+    STATUS_CHOICES = [(PENDING, 'pending'), (RUNNING, 'running'), (DONE, 'done'),
+                      (FAILED, 'failed')]
 
+    id = models.AutoField(primary_key=True)
+    election = models.ForeignKey(Election, on_delete=models.CASCADE)
+    etype = models.CharField('Election method', max_length=20)
+    numwinners = models.PositiveSmallIntegerField('# of winners')
+    ballot_version = models.PositiveIntegerField('Ballot version')
+    status = models.SmallIntegerField('Status', choices=STATUS_CHOICES, default=PENDING)
+
+    attempts = models.PositiveSmallIntegerField('# of attempts', default=0)
+
+    # Pickled tally result, see `PostElection._run_tally`.
+    # Failed jobs store an error result.
+    result = models.BinaryField('Tally result', null=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_started = models.DateTimeField(null=True)
+    date_finished = models.DateTimeField(null=True)
+
+    # Pending jobs are not claimed before this time, after a failed attempt.
+    date_retry = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['election', 'etype', 'numwinners', 'ballot_version'],
+                name='unique_tally_job'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+
+    def __str__(self):
+        return ('Elec.' + str(self.election_id) + '-' + self.etype + '-v'
+                + str(self.ballot_version) + '-' + self.get_status_display())
+
+
+class BallotBatch(models.Model):
+    """Batch of ballots submitted through the ballot API with a client batch id.
+    The API response is stored so a retried batch returns it again
+    instead of saving the ballots twice."""
+    id = models.AutoField(primary_key=True)
+    election = models.ForeignKey(Election, on_delete=models.CASCADE)
+    batch_id = models.CharField('Client batch id', max_length=100)
+    response = models.JSONField('API response')
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['election', 'batch_id'], name='unique_ballot_batch'),
+        ]
+
+
+    def __str__(self):
+        return 'Elec.' + str(self.election_id) + '-batch-' + self.batch_id
+
+
+
+def get_or_create_voter(election: Election, user: User):
+    """Get or create a voter given an election and user.
+    Handles anonymous voters.
+
+    Returns
+    -------
+    voter : Voter
+    created : bool
+        True if a new voter was created.
+    """
+    created = False
     if user_is_anonymous(user):
         voter = Voter(election=election, user=user)
         voter.save()
+        created = True
     else:
         try:
             voter  = Voter.objects.get(election=election, user=user)
         except Voter.DoesNotExist:
             voter = Voter(election=election, user=user)
             voter.save()
-    return voter
\ No newline at end of file
+            created = True
+    return voter, created
\ No newline at end of file
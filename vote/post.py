@@ -8,16 +8,44 @@ import markdown
 
 from vote import voting
 from vote.models import Election, Candidate, SCORE_MAX
+from vote import jobs
+from vote import executors
+from vote.cache import get_or_set, cache_set, results_cache, results_key
+from vote.timing import timer
+from vote.tally import condorcet_winner, compress_ballots, pairwise_counts
 
 from bokeh.plotting import figure
 from bokeh.palettes import RdYlBu, inferno
-from bokeh.embed import file_html, components
-from bokeh.resources import CDN
+from bokeh.embed import components
 from bokeh.models import ColumnDataSource, LinearColorMapper, ColorBar
 
+from django.conf import settings
+
+# Above this number of voters, ballots are plotted as aggregated patterns.
+HEATMAP_VOTER_THRESHOLD = getattr(settings, 'HEATMAP_VOTER_THRESHOLD', 500)
+
+# Max number of ballot patterns plotted in the aggregated heatmap.
+HEATMAP_PATTERN_MAX = getattr(settings, 'HEATMAP_PATTERN_MAX', 200)
 
 logger = logging.getLogger(__name__)
 
+
+def load_ballot_data(election: Election, candidate_ids) -> np.ndarray:
+    """Get voter x candidate ballot data matrix ready for tallying."""
+    data = election.get_ballot_matrix(candidate_ids)
+    return prepare_ballot_data(data, election.ballot_type)
+
+
+def prepare_ballot_data(data: np.ndarray, ballot_type: int) -> np.ndarray:
+    """Convert ballot matrix of `ballot_type` ballots for tallying."""
+    data = np.asarray(data, dtype=float)
+
+    # Make sure ranked ballots are correctly ordered.
+    if data.size > 0 and ballot_type == voting.ID_RANK:
+        data = votesim.votemethods.tools.rcv_reorder(data)
+    return data
+
+
 class PostElection:
     """
     Parameters
@@ -26,9 +54,30 @@ class PostElection:
         Election data pk
     method : str or None
         Election Method type to postprocess data. Set to None to use the method specified for election.
+    numwinners : int or None
+        Number of winners. Set to None to use the number specified for election.
+    background : bool
+        If True, expensive methods on large elections are tallied by a
+        background job instead. Until the job finishes, the last completed
+        result is used and `recalculating` is True.
+    timeout : float or None
+        Seconds to wait for a tally run in the tally process pool before
+        giving up with an error. Set to None to wait indefinitely.
+    data : array shape (a, b) or None
+        Ballots to post-process instead of the election's stored ballots,
+        with columns ordered by candidate id. Results are not cached.
+    weights : array shape (a,) or None
+        Number of voters casting each row of `data`, for unique or
+        pre-aggregated ballots. Set to None for one voter per row.
+        Head-to-head counts, single winner instant runoff, plurality and
+        score are computed from the weighted rows. Other methods expand
+        the rows to one per voter for votesim, which needs memory for
+        every voter.
     """
 
-    def __init__(self, election_id : int, etype: str=None, numwinners: int=None):
+    def __init__(self, election_id : int, etype: str=None, numwinners: int=None,
+                 background: bool=False, timeout: float=executors.TALLY_TIMEOUT,
+                 data: np.ndarray=None, weights: np.ndarray=None):
         self.election = Election.objects.get(pk=election_id)
         if etype is None or etype == '':
             etype = self.election.etype
@@ -42,40 +91,101 @@ class PostElection:
             numwinners = self.election.num_winners
         self.numwinners = numwinners
 
-        self.candidate_ids = self._get_candidate_ids()
-        self.data, self.voter_num = self._get_data()
+        self._pairwise = None
+        self.use_cache = data is None
+        with timer('data'):
+            self.candidate_ids, candidate_names = self._get_candidates()
+            if data is None:
+                self.data, self.voter_num = self._get_data()
+                self.weights = None
+            else:
+                self.data = prepare_ballot_data(data, self.election.ballot_type)
+                self.weights, self.voter_num = self._get_weights(weights)
 
         ## CHECK FOR POST ERRORS
-        if self.data.size == 0:
+        if self.data.size == 0 or self.voter_num == 0:
             self.error_no_voters = True
             return
         else:
             self.error_no_voters = False
 
-        self.candidate_names = [Candidate.objects.get(pk=ii).name for ii in self.candidate_ids]
-        self.candidate_names = np.array(self.candidate_names)
+        self.candidate_names = np.array(candidate_names)
         self.method_name = method_name
 
         self.scoremax = self._get_tally_maxscore()
-        try:
-            self.erunner = votesim.votemethods.eRunner(etype=etype, numwinners=numwinners, ballots=self.data)
-            self.output = self.erunner.output
-            logging.debug(self.output)
-        except Exception as e:
-            self.output = {'error' : str(e)}
+        self.timeout = timeout
+
+        self.recalculating = False
+        key = results_key(self.election, 'tally', etype, numwinners)
+        with timer('tally'):
+            if not self.use_cache:
+                result = self._run_tally()
+            elif background and jobs.use_background(etype, self.voter_num):
+                result = self._get_background_result(key)
+            else:
+                result = results_cache().get(key)
+                if result is None:
+                    result = self._run_tally()
+                    if not result['transient']:
+                        cache_set(key, result)
+
+        if result is None:
+            self.error_no_result = True
+            return
+        self.error_no_result = False
+        self._load_result(result)
+
+
+    def _get_background_result(self, key: str):
+        """Get tally result computed by a background tally job.
+
+        Returns None if no job has completed yet for the election method.
+        """
+        result = results_cache().get(key)
+        if result is not None:
+            return result
+
+        result, is_current = jobs.get_or_enqueue(self.election, self.etype, self.numwinners)
+        if is_current:
+            cache_set(key, result)
+        else:
+            self.recalculating = True
+        return result
+
+
+    def _cached(self, key: str, func):
+        """Get output of `func` from the results cache.
+        Output is not cached while the result is out of date,
+        or for ballots not from the election."""
+        if self.recalculating or not self.use_cache:
+            return func()
+        return get_or_set(key, func)
+
+
+    def _run_tally(self) -> dict:
+        """Run the election method on the ballot data.
+
+        Returns
+        -------
+        out : dict
+            Picklable tally result, see `vote.tally.tally`.
+        """
+        return executors.run_tally(self.etype, self.numwinners, self.data,
+                                   weights=self.weights, timeout=self.timeout)
+
+
+    def _load_result(self, result: dict):
+        """Set winners, ties and output from a tally result."""
+        self.result = result
+        self.output = result['output']
+        self.error_on_run = result['error']
+        self.error_transient = result.get('transient', False)
+        if self.error_on_run:
             self.winners = []
             self.ties = []
-            self.error_on_run = True
         else:
-            self.error_on_run = False
-            winner_indices  = np.asarray(self.erunner.winners_no_ties, dtype=int)
-            logging.debug('Winners indices = %s', winner_indices)
-            tie_indices = self.erunner.ties
-            logger.debug('tie_indices=%s', tie_indices)
-            tie_indices = np.array(tie_indices, dtype=int)
-
-            self.winners = self.candidate_names[winner_indices]
-            self.ties = self.candidate_names[tie_indices]
+            self.winners = self.candidate_names[result['winners']]
+            self.ties = self.candidate_names[result['ties']]
 
 
     def _get_tally_maxscore(self):
@@ -108,97 +218,151 @@ class PostElection:
             text = ''
         return text
 
+    def write_text_condorcet(self):
+        """Write text on the Condorcet winner, for ranked and scored ballots."""
+        if self.election.ballot_type == voting.ID_SINGLE:
+            return ''
+        winner = condorcet_winner(self.get_pairwise_matrix())
+        if winner is None:
+            return 'No candidate beats every other head-to-head.'
+        return 'Condorcet winner, beating every other head-to-head: <b>' + self.candidate_names[winner] + '</b>'
+
+
+    def get_pairwise_matrix(self):
+        """Get head-to-head matrix of the ballots, see `Election.get_pairwise_matrix`."""
+        if self._pairwise is None:
+            with timer('data'):
+                if self.use_cache:
+                    self._pairwise = self.election.get_pairwise_matrix(self.candidate_ids)
+                else:
+                    ranked = self.election.ballot_type == voting.ID_RANK
+                    self._pairwise = pairwise_counts(self.data, ranked, weights=self.weights)
+        return self._pairwise
+
+
     def output_markdown(self):
         s = ''
         for key, value in self.output.items():
             s += f'{key} = \n{value}\n\n'
         s = s.replace('\n', '\n   ')
-        return markdown.markdown(s)
+        with timer('markdown'):
+            return markdown.markdown(s)
 
 
-    def _get_candidate_ids(self):
-        candidates = self.election.candidate_set.all()
-        candidate_ids = [c.id for c in candidates]
-        return candidate_ids
-
+    def _get_candidates(self):
+        """Get candidate id's and names in a single query, ordered by id."""
+        candidates = self.election.candidate_set.order_by('id').values_list('id', 'name')
+        candidate_ids = [c[0] for c in candidates]
+        candidate_names = [c[1] for c in candidates]
+        return candidate_ids, candidate_names
 
 
     def _get_data(self):
-        """Get candidate data and candidate id's."""
-        election = self.election
-        # Get the candidates
-        candidate_ids = self.candidate_ids
-        candidate_num = len(candidate_ids)
-        candidate_ids_index = np.arange(candidate_num)
+        """Get voter x candidate ballot data matrix and number of voters."""
+        data = load_ballot_data(self.election, self.candidate_ids)
+        return data, len(data)
+
+
+    def _get_weights(self, weights):
+        """Validate ballot weights and get them with the number of voters."""
+        if weights is None:
+            return None, len(self.data)
+        weights = np.asarray(weights)
+        if weights.shape != (len(self.data),):
+            raise ValueError('weights must have one entry per ballot.')
+        if not np.issubdtype(weights.dtype, np.integer):
+            if not np.all(np.mod(weights, 1) == 0):
+                raise ValueError('weights must be whole numbers of voters.')
+            weights = weights.astype(int)
+        if np.any(weights < 0):
+            raise ValueError('weights must not be negative.')
+        return weights, int(weights.sum())
+
+
+    def get_ballot_patterns(self):
+        """Get unique ballots and their number of voters, see `vote.tally.compress_ballots`."""
+        return compress_ballots(self.data, self.weights)
+
 
-        search_dict = dict(zip(candidate_ids, candidate_ids_index))
+    def get_components(self):
+        """Get embeddable plots for the election method and the ballot heatmap.
 
-        def get_candidate_index(id):
-            """Retrieve candidate array index."""
-            return search_dict[id]
+        All figures are serialized with a single `bokeh.embed.components` call.
+        Components are cached until a new ballot is submitted.
 
-        # Get all votes
-        ballots = election.get_ballots()
-        ballots_voter_ids = [b.voter.id for b in ballots]
-        ballots_candidate_ids = [b.candidate.id for b in ballots]
-        ballots_votes = [b.vote for b in ballots]
+        Returns
+        -------
+        script : str
+            Single script block rendering all plots.
+        divs : list[str]
+            Div for each election method plot.
+        heatmap_div : str
+            Div for the ballot heatmap.
+        """
+        key = results_key(self.election, 'components', self.etype, self.numwinners)
+        with timer('plot'):
+            return self._cached(key, self._get_components)
 
-        # Turn into numpy arrays
-        ballots_voter_ids = np.asarray(ballots_voter_ids)
-        ballots_candidate_ids = np.asarray(ballots_candidate_ids)
-        ballots_votes = np.asarray(ballots_votes)
 
-        # Get unique voters
-        ballots_voter_ids_unique, inv_index = np.unique(ballots_voter_ids, return_inverse=True)
+    def _get_components(self):
+        figures = self.get_figures()
+        figures.append(self.figure_ballot_heatmap())
+        script, divs = components(figures)
+        divs = list(divs)
+        return script, divs[:-1], divs[-1]
 
-        candidate_id_index = [get_candidate_index(ii) for ii in ballots_candidate_ids]
-        candidate_id_index = np.asarray(candidate_id_index)
 
-        voter_num = len(ballots_voter_ids_unique)
-        data = np.zeros((voter_num, candidate_num))
-        if data.size > 0:
-            data[inv_index, candidate_id_index] = ballots_votes
+    def get_heatmap_components(self):
+        """Get embeddable ballot heatmap only, with the same return as `get_components`."""
+        key = results_key(self.election, 'heatmap-components')
+        with timer('plot'):
+            return self._cached(key, self._get_heatmap_components)
 
-            # Make sure ranked ballots are correctly ordered.
-            if election.ballot_type == voting.ID_RANK:
-                data = votesim.votemethods.tools.rcv_reorder(data)
 
-        return data, voter_num
+    def _get_heatmap_components(self):
+        script, div = components(self.figure_ballot_heatmap())
+        return script, [], div
 
 
-    def get_plots(self):
+    def get_figures(self):
+        """Get list of Bokeh figures for the election method."""
+        return [getattr(self, name)() for name in self.get_plot_names()]
+
+
+    def get_plot_names(self):
+        """Get names of the `plot_*` methods used for the election method."""
         etype = self.etype
         logger.debug('Getting etype = %s', etype)
 
         if etype == votesim.votemethods.PLURALITY:
-            plots = [self.plot_tally()]
+            plots = ['plot_tally']
 
         elif etype == votesim.votemethods.SCORE:
-            plots = [self.plot_score()]
+            plots = ['plot_score']
 
         elif (etype == votesim.votemethods.IRV or
               etype == votesim.votemethods.IRV_STV or
               etype == votesim.votemethods.STV_GREGORY):
             logger.debug('Getting IRV styl plots')
-            plots = [self.plot_irv()]
+            plots = ['plot_irv']
 
         elif etype == votesim.votemethods.STAR:
-            plots = [self.plot_score(), self.plot_runoff_star()]
+            plots = ['plot_score', 'plot_runoff_star']
 
         elif etype == votesim.votemethods.TOP_TWO:
-            plots = [self.plot_tally(), self.plot_runoff()]
+            plots = ['plot_tally', 'plot_runoff']
 
         elif (etype == votesim.votemethods.RANKED_PAIRS or
               etype == votesim.votemethods.SMITH_MINIMAX or
               etype == votesim.votemethods.COPELAND or
               etype == votesim.votemethods.BLACK ):
-            plots = [self.plot_margin_matrix()]
+            plots = ['plot_margin_matrix']
 
         elif etype == votesim.votemethods.BORDA:
-            plots = [self.plot_score()]
+            plots = ['plot_score']
 
         elif etype == votesim.votemethods.SMITH_SCORE:
-            plots = [self.plot_margin_matrix()]
+            plots = ['plot_margin_matrix']
 
         else:
             logger.warning('Method %s has no plotting', etype)
@@ -211,21 +375,21 @@ class PostElection:
     def plot_tally(self):
         """Plot tally, for FPTP, approval, score methods."""
         names = self.candidate_names
-        output = self.erunner.output
+        output = self.output
         try:
             tally = output['first_tally']
         except KeyError:
             tally = output['tally']
 
         title = 'Ballot Tally'
-        return self.plot_runoff_html(names, tally, title=title)
+        return self.figure_runoff(names, tally, title=title)
 
 
 
     def plot_score(self):
         """Plot tally, for FPTP, approval, score methods."""
         names = self.candidate_names
-        output = self.erunner.output
+        output = self.output
         try:
             tally = output['first_tally']
         except KeyError:
@@ -233,20 +397,20 @@ class PostElection:
 
         title = 'Ballot Average Score'
         tally = tally / self.voter_num
-        return self.plot_score_html(names, tally, title=title)
+        return self.figure_score(names, tally, title=title)
 
 
     def plot_runoff(self):
-        output = self.erunner.output
+        output = self.output
         candidate_indices = output['runoff_candidates']
         tally = output['runoff_tally']
         names = self.candidate_names[candidate_indices]
         title = 'Runoff Tally'
-        return self.plot_runoff_html(names, tally, title=title)
+        return self.figure_runoff(names, tally, title=title)
 
 
     def plot_runoff_star(self):
-        output = self.erunner.output
+        output = self.output
         matrix = output['runoff_matrix']
         candidate_indices = output['runoff_candidates']
 
@@ -255,13 +419,13 @@ class PostElection:
 
         title = 'STAR Runoff Tally'
         names = self.candidate_names[candidate_indices]
-        return self.plot_runoff_html(names, tally, title=title)
+        return self.figure_runoff(names, tally, title=title)
 
 
 
     def plot_irv(self, title='Accumulated Votes for Each Round'):
         names = self.candidate_names
-        output = self.erunner.output
+        output = self.output
         voter_num = self.voter_num
         logger.debug('IRV data')
         logger.debug(self.data)
@@ -329,18 +493,16 @@ class PostElection:
         plot.yaxis.major_label_text_font_size = '12pt'
         plot.xaxis.axis_label = 'Net Votes For Each Round R'
 
-        html = file_html(plot, CDN, title=title)
-        return html
+        return plot
 
 
     def plot_margin_matrix(self):
         names = self.candidate_names
-        output = self.erunner.output
-        matrix = output['vote_matrix']
-        return self.plot_margin_matrix_html(names, matrix, title='Head-to-Head Vote Margins')
+        matrix = self.get_pairwise_matrix()
+        return self.figure_margin_matrix(names, matrix, title='Head-to-Head Vote Margins')
 
 
-    def plot_margin_matrix_html(self, names, vote_matrix, width=800, title=''):
+    def figure_margin_matrix(self, names, vote_matrix, width=800, title=''):
         candidates1, candidates2 = np.meshgrid(names, names)
         max_name_len = max(len(c) for c in names)
         vote_matrix = np.asarray(vote_matrix)
@@ -413,12 +575,11 @@ class PostElection:
         plot.yaxis.axis_label_text_font_size = '12pt'
         plot.yaxis.major_label_text_font_size = '12pt'
         plot.yaxis.axis_label = 'Candidate Vote Margin...'
-        html = file_html(plot, CDN, title=title)
-        return html
+        return plot
 
 
-    def plot_score_html(self, names, tally, width=800, title='', ):
-        """Write html for tally plot."""
+    def figure_score(self, names, tally, width=800, title='', ):
+        """Build figure for tally plot."""
         scoremax = self.scoremax
         rating = tally / scoremax * 100
         texts = []
@@ -462,12 +623,11 @@ class PostElection:
         plot.yaxis.axis_label_text_font_size = '12pt'
         plot.yaxis.major_label_text_font_size = '12pt'
 
-        html = file_html(plot, CDN, title=title)
-        return html
+        return plot
 
 
-    def plot_runoff_html(self, names, tally, width=800, title='', ):
-        """Write html for runoff tally plot."""
+    def figure_runoff(self, names, tally, width=800, title='', ):
+        """Build figure for runoff tally plot."""
         net_votes = np.sum(tally)
         height = len(names) * 60 + 60
 
@@ -511,16 +671,19 @@ class PostElection:
         plot.yaxis.axis_label_text_font_size = '12pt'
         plot.yaxis.major_label_text_font_size = '12pt'
 
-        html = file_html(plot, CDN, title=title)
-        return html
+        return plot
 
 
-    def plot_ballot_heatmap(self, width=800):
+    def figure_ballot_heatmap(self, width=800):
+        """Build figure for heatmap plot of ballot data.
+        Switches to the ballot pattern heatmap for large electorates
+        and weighted ballots."""
+        if self.weights is not None or self.voter_num > HEATMAP_VOTER_THRESHOLD:
+            return self.figure_ballot_pattern_heatmap(width)
 
         title = 'Ballot Data'
         ballots = self.data
         candidates = self.candidate_names
-        cnum = len(candidates)
         voters = np.arange(len(ballots))
         height = len(voters) * 5 + 200
         width = len(candidates) * 20 + 150
@@ -528,14 +691,7 @@ class PostElection:
         vmg, cmg = np.meshgrid(voters, candidates, indexing='ij')
         vr = vmg.ravel()
         cr = cmg.ravel()
-        br = ballots.ravel()
-
-        if self.election.ballot_type == voting.ID_RANK:
-            br[br == 0] = cnum
-
-            mapper = LinearColorMapper(palette=inferno(10), low=cnum, high=1)
-        else:
-            mapper = LinearColorMapper(palette=inferno(10), low=br.min(), high=br.max())
+        br, mapper = self._heatmap_values(ballots)
 
         col_data = dict(voter=vr, candidate=cr, ballot=br, y=vr+0.5)
         col_data = ColumnDataSource(data=col_data)
@@ -558,6 +714,87 @@ class PostElection:
             fill_color={'field': 'ballot', 'transform': mapper},
             # line_color="#111111",
         )
+        self._format_heatmap_axes(plot)
+        plot.yaxis.axis_label = 'Voter'
+        return plot
+
+
+    def figure_ballot_pattern_heatmap(self, width=800):
+        """Build figure for heatmap plot of aggregated ballot patterns.
+
+        Identical ballots are grouped, and each ballot pattern is drawn as a row
+        whose height is its number of voters. Only the `HEATMAP_PATTERN_MAX` most
+        common patterns are drawn, so plot size does not grow with voters.
+        """
+        candidates = self.candidate_names
+        patterns, counts = self.get_ballot_patterns()
+        pattern_num = len(patterns)
+
+        # Keep the most common patterns.
+        order = np.argsort(-counts, kind='stable')[: HEATMAP_PATTERN_MAX]
+        patterns = patterns[order]
+        counts = counts[order]
+        shown_num = counts.sum()
+        shown_percent = shown_num / self.voter_num * 100
+
+        title = (f'Ballot Patterns - {len(patterns)} most common of {pattern_num}, '
+                 f'{shown_percent:0.1f}% of voters')
+        height = 800
+        width = len(candidates) * 20 + 150
+
+        bottoms = np.cumsum(counts) - counts
+        pmg, cmg = np.meshgrid(np.arange(len(patterns)), candidates, indexing='ij')
+        pr = pmg.ravel()
+        cr = cmg.ravel()
+        br, mapper = self._heatmap_values(patterns)
+        col_data = dict(
+            pattern=pr + 1,
+            candidate=cr,
+            ballot=br,
+            count=counts[pr],
+            height=counts[pr],
+            y=bottoms[pr] + counts[pr] / 2,
+        )
+        col_data = ColumnDataSource(data=col_data)
+
+        plot = figure(
+            y_range = [0, shown_num],
+            x_range = candidates,
+            plot_height=height,
+            plot_width=width,
+            title=title,
+            tools='save',
+            tooltips = [
+                ('candidate', '@candidate'),
+                ('pattern', '@pattern'),
+                ('# of voters', '@count'),
+                ('value', '@ballot'),
+            ]
+        )
+        plot.rect(
+            source=col_data, y='y', x='candidate', width=1, height='height',
+            fill_color={'field': 'ballot', 'transform': mapper},
+        )
+        self._format_heatmap_axes(plot)
+        plot.yaxis.axis_label = 'Voters, Grouped by Ballot'
+        return plot
+
+
+    def _heatmap_values(self, ballots: np.ndarray):
+        """Get raveled heatmap cell values and color mapper for ballots."""
+        cnum = len(self.candidate_names)
+        br = ballots.ravel().copy()
+
+        if self.election.ballot_type == voting.ID_RANK:
+            br[br == 0] = cnum
+
+            mapper = LinearColorMapper(palette=inferno(10), low=cnum, high=1)
+        else:
+            mapper = LinearColorMapper(palette=inferno(10), low=br.min(), high=br.max())
+        return br, mapper
+
+
+    def _format_heatmap_axes(self, plot):
         plot.xaxis.axis_label_text_font_size = '12pt'
         plot.xaxis.major_label_text_font_size = '12pt'
         plot.xaxis.major_label_orientation = np.pi / 2
@@ -565,6 +802,3 @@ class PostElection:
 
         plot.yaxis.axis_label_text_font_size = '12pt'
         plot.yaxis.major_label_text_font_size = '12pt'
-        plot.yaxis.axis_label = 'Voter'
-        html = file_html(plot, CDN, title=title)
-        return html
\ No newline at end of file
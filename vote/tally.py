@@ -0,0 +1,236 @@
+"""Election method tallying with votesim.
+
+This module does not import Django, so `tally` can be run by the
+tally process pool workers, see `vote.executors`.
+
+Single winner instant runoff is tallied here over unique ballot patterns
+weighted by their number of voters, so its cost scales with the number
+of distinct rankings rather than voters. Weighted single winner
+plurality and score ballots are tallied here by weighted sums. Other
+methods use votesim.
+"""
+import logging
+
+import numpy as np
+import votesim
+
+logger = logging.getLogger(__name__)
+
+# Methods equivalent to instant runoff for a single winner.
+IRV_METHODS = (votesim.votemethods.IRV, votesim.votemethods.IRV_STV)
+
+# Single winner methods electing the candidate with the greatest sum of votes.
+SUM_METHODS = (votesim.votemethods.PLURALITY, votesim.votemethods.SCORE)
+
+
+def tally(etype: str, numwinners: int, ballots: np.ndarray,
+          weights: np.ndarray=None) -> dict:
+    """Run election method `etype` on `ballots`.
+
+    Ballots may be weighted by their integer number of voters `weights`.
+    Except for single winner instant runoff, plurality and score, weighted
+    ballots are expanded to one row per voter for votesim, which needs
+    memory for every voter.
+
+    Returns
+    -------
+    out : dict
+        Picklable tally result with keys 'output', 'winners', 'ties',
+        'error' and 'transient'. Winners and ties are candidate indices.
+        Transient errors, such as timeouts, are not caused by the ballots
+        and the result should not be stored.
+    """
+    ballots = np.asarray(ballots, dtype=float)
+    if etype in IRV_METHODS and numwinners == 1:
+        patterns, counts = compress_ballots(ballots, weights)
+        return irv_tally(patterns, counts)
+    if etype in SUM_METHODS and numwinners == 1 and weights is not None:
+        return sum_tally(ballots, weights)
+    if weights is not None:
+        ballots = np.repeat(ballots, weights, axis=0)
+    try:
+        erunner = votesim.votemethods.eRunner(
+            etype=etype, numwinners=numwinners, ballots=ballots)
+        logger.debug(erunner.output)
+    except Exception as e:
+        return error_result(str(e))
+
+    winner_indices = np.asarray(erunner.winners_no_ties, dtype=int)
+    logger.debug('Winners indices = %s', winner_indices)
+    tie_indices = erunner.ties
+    logger.debug('tie_indices=%s', tie_indices)
+    tie_indices = np.array(tie_indices, dtype=int)
+    return dict(output=erunner.output, winners=winner_indices, ties=tie_indices,
+                error=False, transient=False)
+
+
+def sum_tally(ballots: np.ndarray, weights: np.ndarray) -> dict:
+    """Tally single winner plurality or score ballots by their weighted
+    sum of votes for each candidate. Candidates tied for the greatest
+    sum are returned as ties with no winner.
+
+    Parameters
+    ----------
+    ballots : array shape (a, b)
+    weights : array shape (a,)
+        Number of voters casting each ballot.
+    """
+    sums = np.asarray(weights) @ ballots
+    top = np.flatnonzero(sums == sums.max())
+    if len(top) == 1:
+        winners, ties = top, np.array([], dtype=int)
+    else:
+        winners, ties = np.array([], dtype=int), top
+    return dict(output={'tally' : sums}, winners=winners, ties=ties,
+                error=False, transient=False)
+
+
+def compress_ballots(ballots: np.ndarray, weights: np.ndarray=None):
+    """Collapse identical ballots into unique ballot patterns.
+
+    Parameters
+    ----------
+    ballots : array shape (a, b)
+    weights : array shape (a,) or None
+        Number of voters casting each ballot. Set to None for one voter per ballot.
+
+    Returns
+    -------
+    patterns : array shape (p, b)
+        Unique ballots cast by at least one voter.
+    counts : array shape (p,)
+        Number of voters casting each pattern.
+    """
+    if weights is None:
+        return np.unique(ballots, axis=0, return_counts=True)
+
+    weights = np.asarray(weights)
+    patterns, inverse = np.unique(ballots, axis=0, return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=weights, minlength=len(patterns))
+    counts = counts.astype(weights.dtype)
+    keep = counts > 0
+    return patterns[keep], counts[keep]
+
+
+def irv_tally(patterns: np.ndarray, counts: np.ndarray) -> dict:
+    """Tally single winner instant runoff over weighted rank ballot patterns.
+
+    Each round, ballots count for their top ranked continuing candidate.
+    A candidate with a majority of continuing ballots wins, otherwise the
+    candidate with the fewest votes is eliminated. Ties for elimination
+    are broken by fewest votes in the latest earlier round where they
+    differ, then by candidate order.
+
+    Parameters
+    ----------
+    patterns : array shape (p, b)
+        Rank ballot patterns, 1 is the top rank and 0 is unranked.
+    counts : array shape (p,)
+        Weight, or number of voters, of each pattern.
+
+    Returns
+    -------
+    out : dict
+        Tally result as returned by `tally`. The output has the votes of
+        each candidate per round as 'round_history', and candidates in
+        order of elimination as 'loser_history'.
+    """
+    patterns = np.asarray(patterns, dtype=float)
+    counts = np.asarray(counts, dtype=float)
+    candidate_num = patterns.shape[1]
+    ranks = np.where(patterns > 0, patterns, np.inf)
+    continuing = np.ones(candidate_num, dtype=bool)
+    history = []
+    losers = []
+
+    while True:
+        # Top choice of each pattern among continuing candidates.
+        continuing_ranks = np.where(continuing, ranks, np.inf)
+        top = np.argmin(continuing_ranks, axis=1)
+        active = np.isfinite(continuing_ranks[np.arange(len(top)), top])
+        votes = np.bincount(top[active], weights=counts[active], minlength=candidate_num)
+        history.append(votes)
+
+        candidates = np.flatnonzero(continuing)
+        if len(candidates) == 1 or votes.max() * 2 > votes.sum():
+            winners = np.array([np.argmax(votes)])
+            ties = np.array([], dtype=int)
+            break
+
+        fewest = candidates[votes[candidates] == votes[candidates].min()]
+        if len(fewest) == len(candidates):
+            # All continuing candidates are tied.
+            winners = np.array([], dtype=int)
+            ties = fewest
+            break
+
+        for round_votes in reversed(history[:-1]):
+            fewest = fewest[round_votes[fewest] == round_votes[fewest].min()]
+            if len(fewest) == 1:
+                break
+        loser = fewest[0]
+        continuing[loser] = False
+        losers.append(loser)
+
+    output = dict(
+        round_history=np.array(history),
+        loser_history=np.array(losers, dtype=int),
+        tally=history[0],
+    )
+    return dict(output=output, winners=winners, ties=ties, error=False, transient=False)
+
+
+def error_result(message: str, transient: bool=False) -> dict:
+    """Build the tally result of a failed tally."""
+    return dict(output={'error' : message}, winners=[], ties=[], error=True, transient=transient)
+
+
+def pairwise_counts(ballots: np.ndarray, ranked: bool, chunk_size: int=1024,
+                    weights: np.ndarray=None) -> np.ndarray:
+    """Count head-to-head preferences of ballots.
+
+    Parameters
+    ----------
+    ballots : array shape (a, b)
+        Ballots for `a` voters and `b` candidates.
+    ranked : bool
+        True for rank ballots, where 1 is the top rank and 0 is unranked.
+        Ranked candidates are preferred to unranked ones. Otherwise higher
+        scores are preferred.
+    chunk_size : int
+        Number of ballots compared at once, to bound memory use.
+    weights : array shape (a,) or None
+        Number of voters casting each ballot. Set to None for one voter per ballot.
+
+    Returns
+    -------
+    out : array shape (b, b)
+        Entry [i, j] is the number of voters preferring candidate i to j.
+    """
+    ballots = np.asarray(ballots, dtype=np.int64)
+    candidate_num = ballots.shape[1]
+    if ranked:
+        ballots = np.where(ballots > 0, candidate_num + 1 - ballots, 0)
+
+    if weights is None:
+        weights = np.ones(len(ballots), dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.int64)
+
+    out = np.zeros((candidate_num, candidate_num), dtype=np.int64)
+    for start in range(0, len(ballots), chunk_size):
+        chunk = ballots[start : start + chunk_size]
+        wins = chunk[:, :, None] > chunk[:, None, :]
+        out += np.tensordot(weights[start : start + chunk_size], wins, axes=1)
+    return out
+
+
+def condorcet_winner(matrix: np.ndarray):
+    """Get index of the candidate beating every other head-to-head,
+    from a `pairwise_counts` matrix. Returns None if there is none."""
+    matrix = np.asarray(matrix)
+    wins = matrix > matrix.T
+    np.fill_diagonal(wins, True)
+    winners = np.flatnonzero(wins.all(axis=1))
+    if len(winners) == 0:
+        return None
+    return int(winners[0])
@@ -1,14 +1,49 @@
 
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from django.test import TestCase, RequestFactory, AsyncRequestFactory, override_settings
+from django.http import HttpResponse, Http404
+from django.core.exceptions import MiddlewareNotUsed, ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
 import numpy as np
+import votesim
+from asgiref.sync import sync_to_async, async_to_sync, iscoroutinefunction
 
 from vote import models
 from vote import voting
+from vote import forms
+from vote import bulk
+from vote import jobs
+from vote import executors
+from vote import tally
+from vote import export
+from vote.post import PostElection
+from vote.compare import compare_methods
+from vote.cache import results_cache, results_key
+from vote.views.ballot import user_has_voted
+from vote import timing
+from vote.timing import timer
+from vote.middleware import ServerTimingMiddleware
+from vote.views import AsyncElectionListPopularView, AsyncResultsView
 
 # Create your tests here.
 
 
-class Test1(TestCase):
+class VoteTestCase(TestCase):
+    """Test case clearing per-process state that outlives test transactions."""
+    def setUp(self):
+        models.clear_default_user()
+        results_cache().clear()
+
+
+class Test1(VoteTestCase):
     def test_get_default_user(self):
         user = models.get_default_user()
         print(user)
@@ -21,7 +56,7 @@ class Test1(TestCase):
         
 
 
-class TestIRV(TestCase):
+class TestIRV(VoteTestCase):
     def test_wiki(self):
 
         d = [[1, 2, 3, 4]]*42 + \
@@ -52,4 +87,650 @@ class TestIRV(TestCase):
                 rank_ballot = models.RankBallot(vote=rank, voter=voter, election=e1, candidate=candidate)
                 rank_ballot.save()
 
-        
\ No newline at end of file
+        
+
+def _create_rank_election(ballot_data, etype=votesim.votemethods.IRV):
+    """Create a ranked election and store `ballot_data` one voter per row."""
+    ballot_data = np.asarray(ballot_data)
+    cnum = ballot_data.shape[1]
+    e1 = models.Election(etype=etype, description='test data', num_candidates=cnum)
+    e1.save()
+    candidates = []
+    for ii in range(cnum):
+        c = models.Candidate(name=f'c{ii}', election=e1)
+        c.save()
+        candidates.append(c)
+
+    user = models.get_default_user()
+    for ballot in ballot_data:
+        voter = models.Voter(election=e1, user=user)
+        voter.save()
+        for rank, candidate in zip(ballot, candidates):
+            models.RankBallot(vote=rank, voter=voter, election=e1, candidate=candidate).save()
+    e1.update_voter_num()
+    return e1
+
+
+class TestPostElectionData(VoteTestCase):
+    def test_get_data(self):
+        d = [[1, 2, 0],
+             [0, 1, 2],
+             [2, 0, 1],
+             [1, 0, 0]]
+        e1 = _create_rank_election(d)
+        post = PostElection(e1.pk)
+        self.assertEqual(post.voter_num, 4)
+        self.assertTrue(np.all(post.data == np.array(d)))
+        self.assertEqual(list(post.candidate_names), ['c0', 'c1', 'c2'])
+
+
+    def test_ballot_matrix_append(self):
+        d = [[1, 2, 0],
+             [0, 1, 2]]
+        e1 = _create_rank_election(d)
+        candidate_ids = e1.get_candidate_ids()
+        self.assertTrue(np.all(e1.get_ballot_matrix() == np.array(d)))
+
+        e1.append_ballot(dict(zip(candidate_ids, [2, 0, 1])))
+        e1.num_voters += 1
+        data = e1.get_ballot_matrix()
+        self.assertTrue(np.all(data == np.array(d + [[2, 0, 1]])))
+        self.assertEqual(e1.ballotblock_set.count(), 1)
+
+
+    def test_ballot_matrix_stale_count(self):
+        d = [[1, 2, 0],
+             [0, 1, 2]]
+        e1 = _create_rank_election(d)
+        e1.get_ballot_matrix()
+        stale = models.Election.objects.get(pk=e1.pk)
+        bulk.bulk_create_ballots(e1, [[2, 0, 1]])
+
+        # The voter count is checked again under lock instead of rebuilding.
+        version = e1.ballot_version
+        data = stale.get_ballot_matrix()
+        np.testing.assert_array_equal(data, d + [[2, 0, 1]])
+        stale.refresh_from_db()
+        self.assertEqual(stale.ballot_version, version)
+
+
+class TestResultsCache(VoteTestCase):
+    def test_invalidate_results(self):
+        d = [[1, 2, 0],
+             [0, 1, 2]]
+        e1 = _create_rank_election(d)
+        post = PostElection(e1.pk)
+        key = results_key(post.election, 'tally', post.etype, post.numwinners)
+        self.assertIsNotNone(results_cache().get(key))
+
+        e1.invalidate_results()
+        key2 = results_key(e1, 'tally', post.etype, post.numwinners)
+        self.assertNotEqual(key, key2)
+        self.assertIsNone(results_cache().get(key2))
+
+
+class TestVoterNum(VoteTestCase):
+    def test_update_all(self):
+        e1 = _create_rank_election([[1, 0], [0, 1], [1, 0]])
+        e2 = _create_rank_election([[1, 0]])
+        models.Election.objects.update(num_voters=0)
+
+        num_updated = models.Election.update_all(stop=e2.pk)
+        self.assertEqual(num_updated, 1)
+        e1.refresh_from_db()
+        e2.refresh_from_db()
+        self.assertEqual(e1.num_voters, 3)
+        self.assertEqual(e2.num_voters, 0)
+
+        e3 = bulk.create_election(votesim.votemethods.SCORE, 'poll', ['a', 'b'])
+        bulk.bulk_create_ballots(e3, [[1, 0], [5, 3]])
+        models.Election.objects.filter(pk=e3.pk).update(num_voters=0)
+        progress = mock.Mock()
+        num_updated = models.Election.update_all(batch_size=2, progress=progress)
+        e2.refresh_from_db()
+        e3.refresh_from_db()
+        self.assertEqual(num_updated, 2)
+        self.assertEqual(e2.num_voters, 1)
+        self.assertEqual(e3.num_voters, 2)
+        self.assertEqual(progress.call_args_list, [mock.call(2, 1), mock.call(3, 2)])
+
+
+class TestBallotForms(VoteTestCase):
+    def test_rank_form_save(self):
+        e1 = _create_rank_election([[1, 2, 0]])
+        candidates = e1.candidate_set.all()
+        data = {f'candidate_{c.pk}' : rank for c, rank in zip(candidates, [0, 1, 2])}
+        form = forms.RankForm(candidates, data=data)
+        self.assertTrue(form.is_valid())
+        form.save(models.get_default_user())
+
+        e1.refresh_from_db()
+        self.assertEqual(e1.num_voters, 2)
+        self.assertEqual(e1.ballot_version, 1)
+        self.assertEqual(e1.rankballot_set.count(), 6)
+        self.assertTrue(np.all(e1.get_ballot_matrix() == [[1, 2, 0], [0, 1, 2]]))
+
+
+class TestUserHasVoted(VoteTestCase):
+    def test_registered_user(self):
+        e1 = _create_rank_election([[1, 0]])
+        user = models.get_or_create_user('Bot-voter')
+        request = RequestFactory().get('/')
+        request.user = user
+        request.COOKIES = {}
+        self.assertFalse(user_has_voted(request, e1))
+
+        voter = models.Voter(election=e1, user=user)
+        voter.save()
+        self.assertFalse(user_has_voted(request, e1))
+
+        candidate = e1.candidate_set.first()
+        models.RankBallot(vote=1, voter=voter, election=e1, candidate=candidate).save()
+        with self.assertNumQueries(1):
+            self.assertTrue(user_has_voted(request, e1))
+
+
+class TestDefaultUser(VoteTestCase):
+    def test_memoized(self):
+        user = models.get_default_user()
+        with self.assertNumQueries(0):
+            self.assertEqual(models.get_default_user(), user)
+
+        user.delete()
+        user2 = models.get_default_user()
+        self.assertNotEqual(user2.pk, user.pk)
+
+
+class TestBulk(VoteTestCase):
+    def test_bulk_create_ballots(self):
+        d = np.array([[1, 2, 0],
+                      [0, 1, 2],
+                      [2, 0, 1]])
+        etype = voting.get_method_id(voting.NAME_IRV)
+        e1 = bulk.create_election(etype, 'test bulk', ['a', 'b', 'c'])
+        self.assertEqual(bulk.bulk_create_ballots(e1, d[:2]), 2)
+        self.assertEqual(bulk.bulk_create_ballots(e1, d[2:]), 1)
+
+        e1.refresh_from_db()
+        self.assertEqual(e1.num_voters, 3)
+        self.assertEqual(e1.get_voter_num(), 3)
+        self.assertTrue(np.all(e1.get_ballot_matrix() == d))
+        self.assertTrue(np.all(e1.load_ballot_matrix() == d))
+
+        # Whole number floats are accepted, fractional votes are not truncated.
+        self.assertEqual(bulk.bulk_create_ballots(e1, [[1.0, 2.0, 0.0]]), 1)
+        with self.assertRaises(ValueError):
+            bulk.bulk_create_ballots(e1, [[1.5, 2, 0]])
+        self.assertEqual(e1.voter_set.count(), 4)
+
+    def test_bulk_create_single_ballots(self):
+        d = np.array([[1, 0], [0, 1], [0, 1]])
+        etype = voting.get_method_id(voting.NAME_FPTP)
+        e1 = bulk.create_election(etype, 'test bulk', ['a', 'b'])
+        bulk.bulk_create_ballots(e1, d)
+        self.assertEqual(e1.voteballot_set.count(), 3)
+        self.assertTrue(np.all(e1.load_ballot_matrix() == d))
+
+
+class TestServerTiming(VoteTestCase):
+    @override_settings(SERVER_TIMING=True)
+    def test_header(self):
+        def view(request):
+            with timer('tally'):
+                models.Election.objects.count()
+            return HttpResponse('')
+
+        middleware = ServerTimingMiddleware(view)
+        response = middleware(RequestFactory().get('/'))
+        header = response['Server-Timing']
+        self.assertIn('tally;dur=', header)
+        self.assertIn('db;dur=', header)
+        self.assertIn('total;dur=', header)
+
+    @override_settings(SERVER_TIMING=True)
+    def test_async(self):
+        async def view(request):
+            with timer('tally'):
+                await models.Election.objects.acount()
+            return HttpResponse('')
+
+        middleware = ServerTimingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(AsyncRequestFactory().get('/'))
+        header = response['Server-Timing']
+        self.assertIn('tally;dur=', header)
+        self.assertIn('db;dur=', header)
+
+    def test_thread_pool_queries(self):
+        # Queries run in the results thread pool count toward the request.
+        timing.enable_query_timing()
+        with timing.recording() as timings:
+            async_to_sync(executors.run_in_thread_pool)(models.Election.objects.count)
+        self.assertEqual(timings.counts['db'], 1)
+
+    def test_disabled(self):
+        with timer('tally'):
+            pass
+        with self.assertRaises(MiddlewareNotUsed):
+            ServerTimingMiddleware(lambda request: HttpResponse(''))
+
+
+class TestAsyncViews(VoteTestCase):
+    async def test_popular_list(self):
+        names = ['a', 'b']
+        create = sync_to_async(bulk.create_election)
+        await create(votesim.votemethods.IRV, 'Quiet poll', names)
+        e2 = await create(votesim.votemethods.IRV, 'Busy poll', names)
+        await sync_to_async(bulk.bulk_create_ballots)(e2, [[1, 2]])
+
+        view = AsyncElectionListPopularView.as_view()
+        response = await view(AsyncRequestFactory().get('/view/'))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertLess(content.index('Busy poll'), content.index('Quiet poll'))
+
+        with self.assertRaises(Http404):
+            await view(AsyncRequestFactory().get('/view/?page=2'))
+
+    async def test_results_not_found(self):
+        view = AsyncResultsView.as_view()
+        with self.assertRaises(Http404):
+            await view(AsyncRequestFactory().get('/0/results/'), election_id=0)
+
+
+class TestPairwiseMatrix(VoteTestCase):
+    def test_incremental(self):
+        ballots = np.array([[1, 2, 0], [0, 1, 2], [1, 0, 2], [2, 1, 3]])
+        e1 = bulk.create_election(votesim.votemethods.RANKED_PAIRS, 'poll', ['a', 'b', 'c'])
+        bulk.bulk_create_ballots(e1, ballots[:2])
+        matrix = e1.get_pairwise_matrix()
+        np.testing.assert_array_equal(matrix, [[0, 1, 1], [1, 0, 2], [1, 0, 0]])
+
+        # New ballots update the stored matrix without a rebuild.
+        bulk.bulk_create_ballots(e1, ballots[2:])
+        with mock.patch.object(models.Election, 'rebuild_pairwise_matrix') as rebuild:
+            matrix = e1.get_pairwise_matrix()
+        rebuild.assert_not_called()
+        np.testing.assert_array_equal(matrix, tally.pairwise_counts(ballots, ranked=True))
+
+    def test_stale_count(self):
+        ballots = np.array([[1, 2, 0], [0, 1, 2], [1, 0, 2]])
+        e1 = bulk.create_election(votesim.votemethods.RANKED_PAIRS, 'poll', ['a', 'b', 'c'])
+        bulk.bulk_create_ballots(e1, ballots[:2])
+        e1.get_pairwise_matrix()
+        stale = models.Election.objects.get(pk=e1.pk)
+        bulk.bulk_create_ballots(e1, ballots[2:])
+
+        # The count is checked again under lock instead of rebuilding.
+        with mock.patch.object(models, 'pairwise_counts') as counts:
+            matrix = stale.get_pairwise_matrix()
+        counts.assert_not_called()
+        np.testing.assert_array_equal(matrix, tally.pairwise_counts(ballots, ranked=True))
+
+    def test_condorcet_winner(self):
+        matrix = tally.pairwise_counts([[1, 2, 3], [2, 1, 3], [1, 3, 2]], ranked=True)
+        self.assertEqual(tally.condorcet_winner(matrix), 0)
+        matrix = tally.pairwise_counts([[1, 2, 3], [3, 1, 2], [2, 3, 1]], ranked=True)
+        self.assertIsNone(tally.condorcet_winner(matrix))
+
+
+class TestIRVTally(VoteTestCase):
+    ballots = np.array([[1, 2, 3]] * 4 + [[2, 1, 3]] * 3 + [[2, 3, 1]] * 2)
+
+    def test_rounds(self):
+        result = tally.tally(votesim.votemethods.IRV, 1, self.ballots)
+        self.assertFalse(result['error'])
+        np.testing.assert_array_equal(result['winners'], [0])
+        np.testing.assert_array_equal(result['output']['round_history'], [[4, 3, 2], [6, 3, 0]])
+        np.testing.assert_array_equal(result['output']['loser_history'], [2])
+
+    def test_patterns(self):
+        patterns, counts = tally.compress_ballots(self.ballots)
+        self.assertEqual(len(patterns), 3)
+        np.testing.assert_array_equal(counts.sum(), len(self.ballots))
+        result = tally.irv_tally(patterns, counts * 10)
+        np.testing.assert_array_equal(result['output']['round_history'], [[40, 30, 20], [60, 30, 0]])
+
+    def test_tie(self):
+        result = tally.irv_tally([[1, 2], [2, 1]], [1, 1])
+        self.assertEqual(len(result['winners']), 0)
+        np.testing.assert_array_equal(result['ties'], [0, 1])
+
+
+class TestWeightedBallots(VoteTestCase):
+    patterns = np.array([[1, 2, 3], [2, 1, 3], [2, 3, 1]])
+    weights = np.array([4, 3, 2])
+
+    def test_post(self):
+        e1 = bulk.create_election(votesim.votemethods.BORDA, 'poll', ['a', 'b', 'c'])
+        expanded = np.repeat(self.patterns, self.weights, axis=0)
+        post1 = PostElection(e1.pk, data=expanded)
+        post2 = PostElection(e1.pk, data=self.patterns, weights=self.weights)
+        self.assertEqual(post2.voter_num, 9)
+        self.assertEqual(list(post1.winners), list(post2.winners))
+        np.testing.assert_array_equal(post1.get_pairwise_matrix(), post2.get_pairwise_matrix())
+
+        # Weighted results are not cached as the election's results.
+        key = results_key(e1, 'tally', e1.etype, e1.num_winners)
+        self.assertIsNone(results_cache().get(key))
+
+        with self.assertRaises(ValueError):
+            PostElection(e1.pk, data=self.patterns, weights=[1, 2])
+        with self.assertRaises(ValueError):
+            PostElection(e1.pk, data=self.patterns, weights=[1, -1, 2])
+
+    def test_sum_tally(self):
+        ballots = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        expected = tally.tally(votesim.votemethods.PLURALITY, 1, np.repeat(ballots, [4, 3, 2], axis=0))
+        result = tally.tally(votesim.votemethods.PLURALITY, 1, ballots, [4, 3, 2])
+        np.testing.assert_array_equal(result['winners'], expected['winners'])
+        np.testing.assert_array_equal(result['output']['tally'], [4, 3, 2])
+
+        result = tally.tally(votesim.votemethods.SCORE, 1, [[5, 0], [0, 5]], [1, 1])
+        self.assertEqual(len(result['winners']), 0)
+        np.testing.assert_array_equal(result['ties'], [0, 1])
+
+    def test_compress(self):
+        ballots = np.vstack([self.patterns, self.patterns[:1]])
+        patterns, counts = tally.compress_ballots(ballots, [1, 2, 0, 3])
+        np.testing.assert_array_equal(patterns, self.patterns[:2])
+        np.testing.assert_array_equal(counts, [4, 2])
+
+
+class TestBallotExport(VoteTestCase):
+    def test_csv(self):
+        e1 = bulk.create_election(votesim.votemethods.IRV, 'poll', ['a', 'b', 'c'])
+        ballots = [[1, 2, 3], [2, 1, 0]]
+        bulk.bulk_create_ballots(e1, ballots)
+        response = self.client.get(f'/{e1.pk}/ballots.csv')
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'voter,a,b,c')
+        self.assertEqual([line.split(',')[1:] for line in lines[1:]], [['1', '2', '3'], ['2', '1', '0']])
+
+    def test_single_votes(self):
+        e1 = bulk.create_election(votesim.votemethods.PLURALITY, 'poll', ['a', 'a', 'b'])
+        bulk.bulk_create_ballots(e1, [[0, 1, 0], [0, 0, 1]])
+        candidate_ids = e1.get_candidate_ids()
+        self.assertEqual(export.get_column_names(e1, candidate_ids)[:3], ['voter', 'a', f'a_{candidate_ids[1]}'])
+        rows = [row for _, row in export.iter_ballot_rows(e1, chunk_size=1)]
+        self.assertEqual(rows, [[0, 1, 0], [0, 0, 1]])
+
+    @unittest.skipIf(export.pyarrow is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet
+        e1 = bulk.create_election(votesim.votemethods.SCORE, 'poll', ['a', 'b'])
+        ballots = np.array([[5, 0], [3, 4], [1, 1]])
+        bulk.bulk_create_ballots(e1, ballots)
+        content = b''.join(export.iter_parquet(e1, batch_rows=2))
+        table = pyarrow.parquet.read_table(io.BytesIO(content))
+        self.assertEqual(table.num_rows, 3)
+        np.testing.assert_array_equal(table.column('b').to_numpy(), ballots[:, 1])
+
+
+class TestBallotImport(VoteTestCase):
+    def test_validate(self):
+        rank = np.array([[1, 2, 0], [1, 1, 0], [0, 0, 0], [1, 3, 0], [2, 1, 0.5]])
+        errors = forms.validate_ballot_matrix(rank, voting.ID_RANK)
+        self.assertEqual(list(errors), ['', forms.ERROR_REPEATED_RANKS, forms.ERROR_ALL_ZEROS,
+                                        forms.ERROR_INVALID_VALUE, forms.ERROR_INVALID_VALUE])
+        errors = forms.validate_ballot_matrix([[5, 0], [6, 0]], voting.ID_SCORE)
+        self.assertEqual(list(errors), ['', forms.ERROR_INVALID_VALUE])
+        errors = forms.validate_ballot_matrix([[0, 1], [1, 1]], voting.ID_SINGLE)
+        self.assertEqual(list(errors), ['', forms.ERROR_SINGLE_VOTE])
+
+    def test_import_csv(self):
+        e1 = bulk.create_election(votesim.votemethods.IRV, 'poll', ['a', 'b', 'c'])
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('voter,c,b,a\n1,0,2,1\n2,1,1,0\n3,1,0,2\n')
+        self.addCleanup(os.remove, f.name)
+
+        with self.assertRaises(CommandError):
+            call_command('import_ballots', e1.pk, f.name, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(e1.voter_set.count(), 0)
+
+        call_command('import_ballots', e1.pk, f.name, '--skip-invalid', '--chunk-size', '1',
+                     stdout=io.StringIO())
+        e1.refresh_from_db()
+        self.assertEqual(e1.num_voters, 2)
+        np.testing.assert_array_equal(e1.get_ballot_matrix(), [[1, 2, 0], [2, 0, 1]])
+
+    def test_generated_round_trip(self):
+        ranks = np.argsort(np.random.RandomState(0).rand(20, 4), axis=1) + 1
+        ranks = forms.to_form_ranks(ranks)
+        self.assertEqual(list(forms.validate_ballot_matrix(ranks, voting.ID_RANK)), [''] * 20)
+
+        e1 = bulk.create_election(votesim.votemethods.IRV, 'poll', ['a', 'b', 'c', 'd'])
+        bulk.bulk_create_ballots(e1, ranks)
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(''.join(export.iter_csv(e1)))
+        self.addCleanup(os.remove, f.name)
+
+        e2 = bulk.create_election(votesim.votemethods.IRV, 'poll', ['a', 'b', 'c', 'd'])
+        call_command('import_ballots', e2.pk, f.name, stdout=io.StringIO())
+        np.testing.assert_array_equal(e2.get_ballot_matrix(), ranks)
+
+
+@override_settings(BALLOT_API_TOKEN='secret')
+class TestBallotApi(VoteTestCase):
+    def post(self, election, body, token='secret'):
+        return self.client.post(
+            f'/{election.pk}/api/ballots/', data=json.dumps(body),
+            content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_submit(self):
+        e1 = bulk.create_election(votesim.votemethods.IRV, 'poll', ['a', 'b', 'c'])
+        ids = e1.get_candidate_ids()
+        ballots = [[1, 2, 0], [1, 1, 0], {str(ids[0]) : 0, str(ids[1]) : 0, str(ids[2]) : 1}, [1, 2]]
+        response = self.post(e1, {'ballots' : ballots})
+        self.assertEqual(response.status_code, 200)
+        out = response.json()
+        self.assertEqual(out['accepted'], 2)
+        self.assertEqual([r['status'] for r in out['results']],
+                         ['accepted', 'rejected', 'accepted', 'rejected'])
+        self.assertEqual(out['results'][1]['error'], forms.ERROR_REPEATED_RANKS)
+
+        out = self.post(e1, {'ballots' : [[10**400, 1, 0], [1, 2, 0]]}).json()
+        self.assertEqual(out['accepted'], 1)
+        self.assertEqual(out['results'][0]['error'], forms.ERROR_INVALID_VALUE)
+
+        e1.refresh_from_db()
+        self.assertEqual(e1.num_voters, 3)
+        np.testing.assert_array_equal(e1.get_ballot_matrix(), [[1, 2, 0], [0, 0, 1], [1, 2, 0]])
+
+    def test_auth(self):
+        e1 = bulk.create_election(votesim.votemethods.IRV, 'poll', ['a', 'b'])
+        self.assertEqual(self.post(e1, {'ballots' : []}, token='wrong').status_code, 401)
+        self.assertEqual(self.post(e1, {'votes' : []}).status_code, 400)
+        with override_settings(BALLOT_API_MAX_BALLOTS=1):
+            self.assertEqual(self.post(e1, {'ballots' : [[0, 1], [1, 0]]}).status_code, 413)
+        with override_settings(BALLOT_API_TOKEN=None):
+            self.assertEqual(self.post(e1, {'ballots' : []}).status_code, 404)
+
+    def test_batch_id(self):
+        e1 = bulk.create_election(votesim.votemethods.IRV, 'poll', ['a', 'b', 'c'])
+        body = {'ballots' : [[1, 2, 0], [1, 1, 0]], 'batch_id' : 'kiosk-1'}
+        out = self.post(e1, body).json()
+        self.assertEqual(out['accepted'], 1)
+
+        # A retried batch returns the original response without new voters.
+        response = self.post(e1, body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), out)
+        self.assertEqual(e1.voter_set.count(), 1)
+
+        self.post(e1, dict(body, batch_id='kiosk-2'))
+        self.assertEqual(e1.voter_set.count(), 2)
+        self.assertEqual(self.post(e1, dict(body, batch_id=5)).status_code, 400)
+
+
+class TestCompareMethods(VoteTestCase):
+    def test_compare(self):
+        e1 = _create_rank_election([[1, 2, 0], [0, 1, 2], [1, 0, 2]])
+        rows = compare_methods(e1)
+        self.assertEqual([row['etype'] for row in rows], list(voting.ranked_methods.values()))
+
+        post = PostElection(e1.pk, etype=votesim.votemethods.IRV)
+        row = rows[0]
+        self.assertEqual(row['winners'], list(post.winners))
+
+        # Tally results are shared with the results pages.
+        key = results_key(e1, 'tally', votesim.votemethods.BORDA, e1.num_winners)
+        self.assertIsNotNone(results_cache().get(key))
+        with self.assertNumQueries(0):
+            self.assertEqual(compare_methods(e1), rows)
+
+    def test_no_voters(self):
+        e1 = bulk.create_election(votesim.votemethods.IRV, 'empty', ['a', 'b'])
+        self.assertEqual(compare_methods(e1), [])
+
+    def test_view(self):
+        e1 = bulk.create_election(votesim.votemethods.IRV, 'poll', ['a', 'b', 'c'])
+        bulk.bulk_create_ballots(e1, [[1, 2, 3], [2, 1, 3], [1, 3, 2]])
+        response = self.client.get(f'/{e1.pk}/compare/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, voting.NAME_BORDA)
+        # There must be fewer winners than candidates.
+        self.assertEqual(self.client.get(f'/{e1.pk}/compare/2/').status_code, 200)
+        self.assertEqual(self.client.get(f'/{e1.pk}/compare/3/').status_code, 404)
+
+
+def _slow_tally(etype, numwinners, ballots, weights):
+    time.sleep(10)
+
+
+@mock.patch.object(executors, 'PROCESS_WORKERS', 1)
+class TestTallyProcessPool(VoteTestCase):
+    ballots = np.array([[1, 2, 0], [0, 1, 2], [1, 0, 2]])
+
+    def setUp(self):
+        super().setUp()
+        # Each test creates and shuts down its own pool.
+        patcher = mock.patch.object(executors, '_process_pool', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: executors._process_pool and executors._process_pool.shutdown())
+
+    def test_run_tally(self):
+        result = executors.run_tally(votesim.votemethods.IRV, 1, self.ballots)
+        self.assertFalse(result['error'])
+        expected = executors.tally(votesim.votemethods.IRV, 1, self.ballots)
+        np.testing.assert_array_equal(result['winners'], expected['winners'])
+
+    # Fork so the pool process can unpickle `_slow_tally` without setting up Django.
+    @mock.patch.object(executors, 'START_METHOD', 'fork')
+    def test_timeout(self):
+        executors.run_tally(votesim.votemethods.IRV, 1, self.ballots)
+        processes = list(executors.get_process_pool()._processes.values())
+        with mock.patch.object(executors, 'tally', _slow_tally):
+            result = executors.run_tally(votesim.votemethods.IRV, 1, self.ballots, timeout=0.2)
+        self.assertTrue(result['error'])
+        self.assertTrue(result['transient'])
+
+        # The stuck process is terminated.
+        for process in processes:
+            process.join(5)
+            self.assertFalse(process.is_alive())
+
+        # The pool is replaced and later tallies still run.
+        result = executors.run_tally(votesim.votemethods.IRV, 1, self.ballots)
+        self.assertFalse(result['error'])
+
+    def test_queued_tally(self):
+        # The timeout starts when a worker starts the tally, not while queued.
+        with mock.patch.object(executors, 'tally', time.sleep):
+            executors._submit(0.6)
+        result = executors.run_tally(votesim.votemethods.IRV, 1, self.ballots, timeout=0.3)
+        self.assertFalse(result['error'])
+
+    @mock.patch.object(executors, 'PROCESS_WORKERS', 2)
+    @mock.patch.object(executors, 'START_METHOD', 'fork')
+    def test_timeout_other_tallies(self):
+        # Other tallies running in the pool finish when a stuck one is retired.
+        with mock.patch.object(executors, 'tally', time.sleep):
+            _, running, _ = executors._submit(1.0)
+        with mock.patch.object(executors, 'tally', _slow_tally):
+            result = executors.run_tally(votesim.votemethods.IRV, 1, self.ballots, timeout=0.2)
+        self.assertTrue(result['transient'])
+        self.assertIsNone(running.result(timeout=5))
+
+
+@mock.patch.object(jobs, 'BACKGROUND_MIN_VOTERS', 0)
+@mock.patch.object(jobs, 'BACKGROUND_METHODS', [votesim.votemethods.IRV])
+class TestTallyJobs(VoteTestCase):
+    def test_background_tally(self):
+        e1 = _create_rank_election([[1, 2, 0], [0, 1, 2]])
+        post = PostElection(e1.pk, background=True)
+        self.assertTrue(post.error_no_result)
+        self.assertEqual(models.TallyJob.objects.count(), 1)
+
+        job = jobs.claim_job()
+        self.assertIsNone(jobs.claim_job())
+        jobs.run_job(job)
+
+        post = PostElection(e1.pk, background=True)
+        self.assertFalse(post.error_no_result)
+        self.assertFalse(post.recalculating)
+
+        # New ballots make the result stale until the next job finishes.
+        e1.invalidate_results()
+        post = PostElection(e1.pk, background=True)
+        self.assertFalse(post.error_no_result)
+        self.assertTrue(post.recalculating)
+        jobs.run_job(jobs.claim_job())
+        self.assertEqual(models.TallyJob.objects.count(), 1)
+
+
+    def test_ballots_changed(self):
+        e1 = _create_rank_election([[1, 2, 0], [0, 1, 2]])
+        jobs.get_or_enqueue(e1, 'irv', 1)
+        job = jobs.claim_job()
+
+        # The result is stored for the ballots the job actually tallied.
+        e1.invalidate_results()
+        jobs.get_or_enqueue(e1, 'irv', 1)
+        jobs.run_job(job)
+        e1.refresh_from_db()
+        self.assertEqual(job.ballot_version, e1.ballot_version)
+        self.assertEqual(models.TallyJob.objects.count(), 1)
+        result, is_current = jobs.get_or_enqueue(e1, 'irv', 1)
+        self.assertTrue(is_current)
+
+
+    def test_check_methods(self):
+        jobs.check_methods([votesim.votemethods.RANKED_PAIRS])
+        with self.assertRaises(ImproperlyConfigured):
+            jobs.check_methods(['ranked_pair'])
+
+
+    def test_stale_pending_jobs(self):
+        e1 = _create_rank_election([[1, 2, 0], [0, 1, 2]])
+        jobs.get_or_enqueue(e1, 'irv', 1)
+        jobs.get_or_enqueue(e1, 'irv', 1)
+        self.assertEqual(models.TallyJob.objects.count(), 1)
+
+        # The job for the old ballot version is dropped instead of run.
+        e1.invalidate_results()
+        jobs.get_or_enqueue(e1, 'irv', 1)
+        job = jobs.claim_job()
+        self.assertEqual(job.ballot_version, e1.ballot_version)
+        self.assertEqual(models.TallyJob.objects.count(), 1)
+
+
+    def test_failed_job(self):
+        e1 = _create_rank_election([[1, 2, 0], [0, 1, 2]])
+        jobs.get_or_enqueue(e1, 'irv', 1)
+        for ii in range(jobs.MAX_ATTEMPTS):
+            job = jobs.claim_job()
+            self.assertEqual(job.attempts, ii + 1)
+            jobs.retry_job(job, 'Calculation failed.')
+            # Retried jobs wait before they can be claimed again.
+            self.assertIsNone(jobs.claim_job())
+            models.TallyJob.objects.update(date_retry=None)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.TallyJob.FAILED)
+        result, is_current = jobs.get_or_enqueue(e1, 'irv', 1)
+        self.assertTrue(is_current)
+        self.assertTrue(result['error'])
+        self.assertEqual(result['output']['error'], 'Calculation failed.')
@@ -0,0 +1,119 @@
+"""Lightweight per-request phase timing.
+
+Phases are timed with the `timer` context manager. Timings are only
+recorded while a `Timings` recorder is active for the current request or
+task, see `vote.middleware.ServerTimingMiddleware`. Otherwise `timer`
+does nothing.
+
+Once `enable_query_timing` is called, database query time is recorded
+as phase 'db'. The query wrapper is installed on every connection, so
+queries of any thread running in the recorder's context are counted,
+including sync_to_async threads and the results thread pool.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_timings = ContextVar('vote_timings', default=None)
+
+
+class Timings:
+    """Record accumulated durations and counts of named phases."""
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+        # Phases may be added from pool threads of the request.
+        self._lock = Lock()
+
+
+    def add(self, name: str, duration: float):
+        """Add `duration` seconds to phase `name`."""
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + duration
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+    def server_timing(self) -> str:
+        """Format timings as a Server-Timing header value."""
+        metrics = []
+        for name, duration in self.durations.items():
+            metric = f'{name};dur={duration * 1000:0.2f}'
+            if self.counts[name] > 1:
+                metric += f';desc="{self.counts[name]}x"'
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+
+    def to_dict(self) -> dict:
+        """Get timings in milliseconds and counts of each phase."""
+        return {
+            name : {'ms' : round(duration * 1000, 3), 'count' : self.counts[name]}
+            for name, duration in self.durations.items()
+        }
+
+
+@contextmanager
+def recording():
+    """Activate a new `Timings` recorder within the context.
+
+    Yields
+    ------
+    timings : Timings
+    """
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def timer(name: str):
+    """Time the context as phase `name` if a recorder is active."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - t0)
+
+
+def record(name: str, duration: float):
+    """Add `duration` seconds to phase `name` if a recorder is active."""
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, duration)
+
+
+def enable_query_timing():
+    """Install the query timing wrapper on all current and future
+    database connections of the process."""
+    connection_created.connect(_install_query_timer, dispatch_uid='vote_timing_queries')
+    for connection in connections.all(initialized_only=True):
+        _install_query_timer(connection=connection)
+
+
+def _install_query_timer(sender=None, connection=None, **kwargs):
+    # Wrappers persist on the connection object across reconnects.
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def _time_query(execute, sql, params, many, context):
+    """Database execute wrapper recording query time if a recorder is active."""
+    if _timings.get() is None:
+        return execute(sql, params, many, context)
+    t0 = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', time.perf_counter() - t0)
@@ -1,4 +1,7 @@
 from vote.views.ballot import CreateBallotView
 from vote.views.create import CreateElectionView
-from vote.views.results import ResultsView
+from vote.views.results import ResultsView, AsyncResultsView, CompareView
 from vote.views.elist import ElectionListLatestView, ElectionListPopularView
+from vote.views.elist import AsyncElectionListLatestView, AsyncElectionListPopularView
+from vote.views.export import BallotExportView, BallotParquetExportView
+from vote.views.api import BallotApiView
@@ -0,0 +1,165 @@
+"""JSON API for submitting many ballots at once, for kiosk and integration clients.
+
+The API is enabled by setting BALLOT_API_TOKEN. Clients authenticate with
+an `Authorization: Bearer <token>` header instead of sessions and CSRF.
+"""
+import hmac
+import json
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from vote import bulk
+from vote.forms import validate_ballot_matrix, ERROR_INVALID_VALUE
+from vote.models import Election, BallotBatch
+
+logger = logging.getLogger(__name__)
+
+ERROR_BALLOT_FORMAT = 'Ballot must have a vote for every candidate.'
+
+# Max length of client batch ids, see `BallotBatch`.
+BATCH_ID_MAX_LENGTH = BallotBatch._meta.get_field('batch_id').max_length
+
+
+def parse_ballots(ballots: list, candidate_ids: list):
+    """Convert JSON ballots to a ballot matrix.
+
+    Each ballot is either a list of votes ordered by candidate id, or an
+    object mapping every candidate id to its vote.
+
+    Returns
+    -------
+    data : array shape (a, b)
+        Ballots, with rows of malformed ballots set to zero.
+    errors : array shape (a,)
+        Error message of each malformed ballot, or ''.
+    """
+    cnum = len(candidate_ids)
+    keys = [str(cid) for cid in candidate_ids]
+    data = np.zeros((len(ballots), cnum))
+    errors = np.full(len(ballots), '', dtype=object)
+    for ii, ballot in enumerate(ballots):
+        if isinstance(ballot, dict) and sorted(ballot) == sorted(keys):
+            row = [ballot[key] for key in keys]
+        elif isinstance(ballot, list) and len(ballot) == cnum:
+            row = ballot
+        else:
+            errors[ii] = ERROR_BALLOT_FORMAT
+            continue
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in row):
+            errors[ii] = ERROR_BALLOT_FORMAT
+            continue
+        try:
+            data[ii] = row
+        except (OverflowError, ValueError):
+            # JSON ints too large for a float.
+            errors[ii] = ERROR_INVALID_VALUE
+    return data, errors
+
+
+def save_ballots(election: Election, ballots: list) -> dict:
+    """Validate JSON ballots and save the valid ones as new anonymous voters.
+
+    Returns
+    -------
+    out : dict
+        API response with the number of accepted and rejected ballots,
+        and the status of each ballot in request order.
+    """
+    candidate_ids = election.get_candidate_ids()
+    data, errors = parse_ballots(ballots, candidate_ids)
+    if len(data):
+        form_errors = validate_ballot_matrix(data, election.ballot_type)
+        errors = np.where(errors == '', form_errors, errors)
+    valid = errors == ''
+
+    num_accepted = bulk.bulk_create_ballots(election, data[valid], candidate_ids=candidate_ids)
+    logger.info('Accepted %s of %s API ballots for election %s.',
+                num_accepted, len(ballots), election.pk)
+
+    results = []
+    for ii, error in enumerate(errors):
+        if error:
+            results.append({'index' : ii, 'status' : 'rejected', 'error' : error})
+        else:
+            results.append({'index' : ii, 'status' : 'accepted'})
+    out = {
+        'accepted' : num_accepted,
+        'rejected' : len(ballots) - num_accepted,
+        'results' : results,
+    }
+    return out
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class BallotApiView(View):
+    """Validate and save a batch of ballots for an election.
+
+    Request body is `{"ballots": [...]}`, see `parse_ballots`. All ballots
+    are validated with the ballot form rules, and the valid ones are saved
+    in a single transaction as new anonymous voters. The response lists
+    the status of each ballot in request order.
+
+    Clients can add a `"batch_id"` string to make retries safe. The first
+    response for a batch id is stored, and requests repeating the batch id
+    get that response back without saving the ballots again.
+
+    The API is disabled unless the BALLOT_API_TOKEN setting is set, and
+    BALLOT_API_MAX_BALLOTS limits the number of ballots per request.
+    Settings are read on each request.
+    """
+    def post(self, request, election_id, *args, **kwargs):
+        token = getattr(settings, 'BALLOT_API_TOKEN', None)
+        max_ballots = getattr(settings, 'BALLOT_API_MAX_BALLOTS', 10000)
+        if not token:
+            raise Http404('Ballot API is not enabled.')
+        auth = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth.encode(), f'Bearer {token}'.encode()):
+            return JsonResponse({'error' : 'Invalid API token.'}, status=401)
+
+        election = get_object_or_404(Election, pk=election_id)
+        try:
+            body = json.loads(request.body)
+            ballots = body['ballots']
+        except RequestDataTooBig:
+            return JsonResponse({'error' : 'Request is too large.'}, status=413)
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error' : 'Body must be a JSON object with a "ballots" list.'}, status=400)
+        if not isinstance(ballots, list):
+            return JsonResponse({'error' : '"ballots" must be a list.'}, status=400)
+        if len(ballots) > max_ballots:
+            return JsonResponse(
+                {'error' : f'At most {max_ballots} ballots can be sent at once.'}, status=413)
+
+        batch_id = body.get('batch_id')
+        if batch_id is None:
+            return JsonResponse(save_ballots(election, ballots))
+        if not isinstance(batch_id, str) or not 0 < len(batch_id) <= BATCH_ID_MAX_LENGTH:
+            return JsonResponse(
+                {'error' : f'"batch_id" must be a string of 1 to {BATCH_ID_MAX_LENGTH} characters.'},
+                status=400)
+
+        batches = BallotBatch.objects.filter(election=election, batch_id=batch_id)
+        try:
+            with transaction.atomic():
+                # Lock the election so retries of a batch are serialized.
+                Election.objects.select_for_update().values_list('pk').get(pk=election.pk)
+                batch = batches.first()
+                if batch is None:
+                    out = save_ballots(election, ballots)
+                    BallotBatch.objects.create(election=election, batch_id=batch_id, response=out)
+                    return JsonResponse(out)
+        except IntegrityError:
+            # Saved by a concurrent retry, and our ballots were rolled back.
+            batch = batches.get()
+        logger.info('Replayed API batch %s for election %s.', batch_id, election.pk)
+        return JsonResponse(batch.response)
+
@@ -29,21 +29,25 @@ class UserHandler:
             self.user = get_default_user()
 
 
-def user_has_voted(request, election_id: int):
-    """bool : Determine whether the current user in current session has voted yet."""
-    user_handler = UserHandler(request)
-    user = user_handler.user
-    election = get_object_or_404(Election, pk=election_id)
+def user_has_voted(request, election: Election, user_handler: UserHandler=None):
+    """bool : Determine whether the current user in current session has voted yet.
+
+    Parameters
+    ----------
+    request : HttpRequest
+    election : Election
+        Already loaded election.
+    user_handler : UserHandler or None
+        Handler of the request user. Created if not given.
+    """
+    if user_handler is None:
+        user_handler = UserHandler(request)
+    election_id = election.pk
 
     if user_handler.is_authenticated:
-        voters = user.voter_set.filter(election=election)
-        if len(voters) > 0:
-            voteballots = voters[0].voteballot_set.all()
-            if len(voteballots) > 0:
-                return True
-            rankballots = voters[0].rankballot_set.all()
-            if len(rankballots) > 0:
-                return True
+        # Single EXISTS query on the ballots of this user's voter.
+        ballots = election.get_ballots().filter(voter__user=user_handler.user)
+        return ballots.exists()
 
     # Check if anonymous voter has voted
     else:
@@ -78,7 +82,7 @@ class CreateBallotView(View):
         user = user_handler.user
 
         # Check if registered user has voted
-        has_voted = user_has_voted(request, election_id)
+        has_voted = user_has_voted(request, election, user_handler)
 
         self.election = election
         self.candidates = candidates
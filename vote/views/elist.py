@@ -1,6 +1,9 @@
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.http import Http404
+from django.views import View
+from asgiref.sync import sync_to_async
 
 from vote import voting
 from vote.models import Candidate, Election, get_default_user
@@ -23,3 +26,44 @@ class ElectionListPopularView(ListView):
     ordering = ['-num_voters']
     paginate_by = 20
 
+
+
+class AsyncElectionListView(View):
+    """Async election list for ASGI deployments.
+
+    Lists one page of elections, selected by the `page` query parameter,
+    using the async ORM.
+    """
+    template_name = None
+    ordering = None
+    paginate_by = None
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            raise Http404('Invalid page.')
+        if page < 1:
+            raise Http404('Invalid page.')
+
+        start = (page - 1) * self.paginate_by
+        queryset = Election.objects.order_by(*self.ordering)[start : start + self.paginate_by]
+        elections = [election async for election in queryset]
+        if page > 1 and not elections:
+            raise Http404('Invalid page.')
+
+        # Rendering may read session messages, which is sync database access.
+        context = {'elections' : elections}
+        return await sync_to_async(render)(request, self.template_name, context)
+
+
+class AsyncElectionListLatestView(AsyncElectionListView):
+    template_name = ElectionListLatestView.template_name
+    ordering = ElectionListLatestView.ordering
+    paginate_by = ElectionListLatestView.paginate_by
+
+
+class AsyncElectionListPopularView(AsyncElectionListView):
+    template_name = ElectionListPopularView.template_name
+    ordering = ElectionListPopularView.ordering
+    paginate_by = ElectionListPopularView.paginate_by
@@ -0,0 +1,39 @@
+from django.http import StreamingHttpResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.views import View
+
+from vote import export
+from vote.models import Election
+
+
+class BallotExportView(View):
+    """Stream all ballots of an election as a CSV file, one row per voter."""
+    content_type = 'text/csv'
+    extension = 'csv'
+
+    def get(self, request, election_id, *args, **kwargs):
+        election = get_object_or_404(Election, pk=election_id)
+        response = StreamingHttpResponse(
+            self.iter_content(election), content_type=self.content_type)
+        filename = f'election-{election.pk}-ballots.{self.extension}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+    def iter_content(self, election):
+        return export.iter_csv(election)
+
+
+class BallotParquetExportView(BallotExportView):
+    """Stream all ballots of an election as a Parquet file. Needs pyarrow."""
+    content_type = 'application/vnd.apache.parquet'
+    extension = 'parquet'
+
+    def get(self, request, election_id, *args, **kwargs):
+        if export.pyarrow is None:
+            raise Http404('Parquet export is not available.')
+        return super().get(request, election_id, *args, **kwargs)
+
+
+    def iter_content(self, election):
+        return export.iter_parquet(election)
@@ -9,82 +9,150 @@ from vote.forms import RecalculateForm
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.template import loader
 from django.views import View
 
+from bokeh.resources import CDN
+
 from vote import voting
 
 from vote.models import Candidate, Election, get_default_user
 from vote.post import PostElection
+from vote.compare import compare_methods
 from vote.views.ballot import user_has_voted
+from vote.timing import timer
+from vote.executors import run_in_thread_pool
+
+
+
+def get_results_context(post: PostElection, form: RecalculateForm) -> dict:
+    """Build results template context for an election with voters."""
+    if not post.error_on_run:
+        script, plots, heatmap = post.get_components()
+    else:
+        script, plots, heatmap = post.get_heatmap_components()
+    context = {
+        'post' : post,
+        'bokeh_resources' : CDN.render_js(),
+        'bokeh_script' : script,
+        'bokeh_plots' : plots,
+        'bokeh_heatmap' : heatmap,
+        'output' : post.output_markdown,
+        'form' : form,
+    }
+    return context
+
+
+def render_results(request, post: PostElection):
+    """Render the results page of a post-processed election."""
+    form = RecalculateForm(
+        post.election,
+        initial={'etype' : post.etype, 'numwinners' : post.numwinners}
+    )
+
+    # Check for post errors
+    if post.error_no_voters:
+        messages.error(request, 'No voter ballots found for this election!')
+        context = {'form' : form}
+        return render(request, 'vote/results.html', context=context)
 
-# def view_results(request, election_id, etype=None):
-#     post = PostElection(election_id=election_id, etype=etype)
-#     plots = post.get_plots()
-#     # markdown = post.markdown
+    if post.recalculating:
+        messages.info(request, 'Results are being recalculated with the latest ballots. Refresh to update.')
+    if post.error_no_result:
+        context = {'form' : form}
+        return render(request, 'vote/results.html', context=context)
 
-#     context = {
-#         'post' : post,
-#         'bokeh_plots' : plots,
-#         'output' : post.output_markdown
-#     }
-#     return render(request, 'vote/results.html', context=context)
+    # Return pot output
+    if post.error_on_run:
+        messages.error(request, 'Error encountered during method calculation.')
+        if post.error_transient:
+            messages.warning(request, 'The calculation did not finish in time. Refresh to try again.')
+        elif post.voter_num <= post.numwinners:
+            messages.warning(request, 'More voters may need to vote in order to correctly calculate the result.')
+    context = get_results_context(post, form)
+    with timer('render'):
+        return render(request, 'vote/results.html', context=context)
 
 
-class ResultsView(View):
+def recalculate_redirect(request, election: Election, *args, **kwargs):
+    """Redirect a results page form submission to the chosen results or ballot page."""
+    election_id = election.pk
+    form = RecalculateForm(election, data=request.POST)
 
-    def get(self, request, election_id, etype=None, numwinners=None, *args, **kwargs):
-        post = PostElection(election_id=election_id, etype=etype, numwinners=numwinners)
-        election = post.election
+    if 'submit' in request.POST:
+        if form.is_valid():
+            etype = form.cleaned_data['etype']
+            numwinners = form.cleaned_data['numwinners']
+            kwargs['etype'] = etype
+            kwargs['numwinners'] = numwinners
+            return redirect('view-results-etype-numwinners', election_id=election_id, *args, **kwargs)
+        else:
+            messages.error(request, 'Invalid form submission.')
+            for key, value in form.errors.items():
+                messages.error(request, key + ' - ' + str(value))
+            return redirect('view-results', election_id=election_id, *args, **kwargs)
 
-        form = RecalculateForm(
-            post.election,
-            initial={'etype' : post.etype, 'numwinners' : post.numwinners}
-        )
+    elif 'vote' in request.POST:
+        # kwargs['etype'] = election.get_etype()
+        return redirect('create-ballot', election_id=election_id)
 
-        # Check for post errors
-        if post.error_no_voters:
-            messages.error(request, 'No voter ballots found for this election!')
-            context = {'form' : form}
-            return render(request, 'vote/results.html', context=context)
 
-        # Return pot output
-        if not post.error_on_run:
-            plots = post.get_plots()
-        else:
-            messages.error(request, 'Error encountered during method calculation.')
-            if post.voter_num <= post.numwinners:
-                messages.warning(request, 'More voters may need to vote in order to correctly calculate the result.')
-            plots = []
-        context = {
-            'post' : post,
-            'bokeh_plots' : plots,
-            'output' : post.output_markdown,
-            'form' : form,
-        }
-        return render(request, 'vote/results.html', context=context)
+class ResultsView(View):
+
+    def get(self, request, election_id, etype=None, numwinners=None, *args, **kwargs):
+        post = PostElection(election_id=election_id, etype=etype, numwinners=numwinners,
+                            background=True)
+        return render_results(request, post)
 
 
     def post(self, request, election_id, *args, **kwargs):
         election = Election.objects.get(pk=election_id)
-        form = RecalculateForm(election, data=request.POST)
-
-        if 'submit' in request.POST:
-            if form.is_valid():
-                etype = form.cleaned_data['etype']
-                numwinners = form.cleaned_data['numwinners']
-                kwargs['etype'] = etype
-                kwargs['numwinners'] = numwinners
-                return redirect('view-results-etype-numwinners', election_id=election_id, *args, **kwargs)
-            else:
-                messages.error(request, 'Invalid form submission.')
-                for key, value in form.errors.items():
-                    messages.error(request, key + ' - ' + str(value))
-                return redirect('view-results', election_id=election_id, *args, **kwargs)
-
-        elif 'vote' in request.POST:
-            # kwargs['etype'] = election.get_etype()
-            return redirect('create-ballot', election_id=election_id)
-
+        return recalculate_redirect(request, election, *args, **kwargs)
+
+
+class CompareView(View):
+    """Table of winners under every voting method valid for the ballot type."""
+    def get(self, request, election_id, numwinners=None, *args, **kwargs):
+        election = get_object_or_404(Election, pk=election_id)
+        if numwinners is None:
+            numwinners = election.num_winners
+        if numwinners < 1 or numwinners >= election.num_candidates:
+            raise Http404('Invalid number of winners.')
+        rows = compare_methods(election, numwinners)
+        if not rows:
+            messages.error(request, 'No voter ballots found for this election!')
+        if any(row['pending'] for row in rows):
+            messages.info(request, 'Some methods are being calculated with the latest ballots. Refresh to update.')
 
+        context = {
+            'election' : election,
+            'numwinners' : numwinners,
+            'rows' : rows,
+        }
+        with timer('render'):
+            return render(request, 'vote/compare.html', context=context)
+
+
+class AsyncResultsView(View):
+    """Async results view for ASGI deployments.
+
+    Election lookups use the async ORM. Tallying, plotting and rendering
+    run in the bounded results thread pool, so slow results pages do not
+    block other requests served by the process.
+    """
+    async def get(self, request, election_id, etype=None, numwinners=None, *args, **kwargs):
+        if not await Election.objects.filter(pk=election_id).aexists():
+            raise Http404('Election not found.')
+        post = await run_in_thread_pool(
+            PostElection, election_id=election_id, etype=etype, numwinners=numwinners,
+            background=True)
+        return await run_in_thread_pool(render_results, request, post)
+
+
+    async def post(self, request, election_id, *args, **kwargs):
+        try:
+            election = await Election.objects.aget(pk=election_id)
+        except Election.DoesNotExist:
+            raise Http404('Election not found.')
+        return recalculate_redirect(request, election, *args, **kwargs)
@@ -73,6 +73,16 @@ all_method_ids = list(all_methods.values())
 all_method_etype_list = list(all_methods.values())
 
 
+def get_ballot_type_methods(ballot_type : int) -> dict:
+    """Get dict of method name to method key valid for ballot type id."""
+    if ballot_type == ID_SCORE:
+        return scored_methods
+    elif ballot_type == ID_RANK:
+        return ranked_methods
+    elif ballot_type == ID_SINGLE:
+        return single_methods
+
+
 def get_method_id(method : str):
     """Given method name, retrieve method ID."""
     return all_methods[method]
@@ -0,0 +1,20 @@
+"""Task wrapper run by the tally process pool workers, see `vote.executors`.
+
+Like `vote.tally`, this module does not import Django, so workers
+started with 'spawn' or 'forkserver' can import it.
+"""
+
+# Queue of started task ids, set in each worker by `init_worker`.
+_started = None
+
+
+def init_worker(started):
+    """Pool initializer storing the queue the worker reports started tasks to."""
+    global _started
+    _started = started
+
+
+def run_task(task_id: int, func, *args):
+    """Report that task `task_id` has started, then return `func(*args)`."""
+    _started.put(task_id)
+    return func(*args)
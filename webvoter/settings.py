@@ -15,6 +15,7 @@ import os
 from dotenv import load_dotenv
 import django_heroku
 import dj_database_url
+import votesim
 
 # Load .env file
 load_dotenv()
@@ -62,6 +63,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'vote.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -107,6 +109,39 @@ if HEROKU:
 
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# Local memory caches evict the least recently used entries once full.
+# Each web worker process has its own results cache. Entries holding the
+# embedded Bokeh plots of an election can take several hundred KB with
+# many candidates, so the cache can use up to about
+# RESULTS_CACHE_MAX_ENTRIES x 0.5 MB of memory per process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'results',
+        'TIMEOUT': float(os.getenv('RESULTS_CACHE_TIMEOUT', 3600)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('RESULTS_CACHE_MAX_ENTRIES', 200)),
+        },
+    },
+}
+
+# Cache used to store tallied election results.
+VOTE_RESULTS_CACHE = 'results'
+
+
+# Results plot settings
+# Ballot heatmaps for elections with more voters than this are aggregated
+# into ballot patterns, keeping at most HEATMAP_PATTERN_MAX patterns.
+HEATMAP_VOTER_THRESHOLD = int(os.getenv('HEATMAP_VOTER_THRESHOLD', 500))
+HEATMAP_PATTERN_MAX = int(os.getenv('HEATMAP_PATTERN_MAX', 200))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -153,6 +188,53 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 CRISPY_FAIL_SILENTLY = not DEBUG
 
 
+# Background tallying
+# These methods are tallied by `manage.py run_tally_worker` for elections with
+# at least TALLY_BACKGROUND_MIN_VOTERS voters, instead of in the request.
+TALLY_BACKGROUND_METHODS = [
+    votesim.votemethods.STV_GREGORY,
+    votesim.votemethods.RANKED_PAIRS,
+    votesim.votemethods.SEQUENTIAL_MONROE,
+]
+TALLY_BACKGROUND_MIN_VOTERS = int(os.getenv('TALLY_BACKGROUND_MIN_VOTERS', 5000))
+# Failed jobs are retried after TALLY_JOB_RETRY_DELAY seconds, and store an
+# error result after TALLY_JOB_MAX_ATTEMPTS attempts.
+TALLY_JOB_MAX_ATTEMPTS = int(os.getenv('TALLY_JOB_MAX_ATTEMPTS', 3))
+TALLY_JOB_RETRY_DELAY = float(os.getenv('TALLY_JOB_RETRY_DELAY', 30))
+
+
+# Tally process pool
+# Set TALLY_PROCESS_WORKERS to run tallies in a pool of that many processes
+# per web worker, instead of in the request thread. Tallies in the pool
+# taking longer than TALLY_TIMEOUT seconds are aborted with an error.
+TALLY_PROCESS_WORKERS = int(os.getenv('TALLY_PROCESS_WORKERS', 0))
+TALLY_TIMEOUT = float(os.getenv('TALLY_TIMEOUT', 30))
+# Start method of tally processes, defaults to 'forkserver' where available.
+if os.getenv('TALLY_PROCESS_START_METHOD'):
+    TALLY_PROCESS_START_METHOD = os.getenv('TALLY_PROCESS_START_METHOD')
+
+
+# Bulk ballot JSON API
+# Set BALLOT_API_TOKEN to enable POST /<election_id>/api/ballots/ for
+# clients sending `Authorization: Bearer <token>`.
+BALLOT_API_TOKEN = os.getenv('BALLOT_API_TOKEN')
+BALLOT_API_MAX_BALLOTS = int(os.getenv('BALLOT_API_MAX_BALLOTS', 10000))
+
+
+# Per-request timing instrumentation
+# Set SERVER_TIMING=1 to add Server-Timing response headers with query,
+# tally, plot and render times. SERVER_TIMING_LOG=1 also logs them as JSON.
+SERVER_TIMING = (os.getenv('SERVER_TIMING') == '1')
+SERVER_TIMING_LOG = (os.getenv('SERVER_TIMING_LOG') == '1')
+
+
+# Async views
+# Set ASYNC_VIEWS=1 when serving webvoter.asgi, see Procfile.asgi. Results
+# pages are then computed in a pool of RESULTS_THREAD_WORKERS threads.
+ASYNC_VIEWS = (os.getenv('ASYNC_VIEWS') == '1')
+RESULTS_THREAD_WORKERS = int(os.getenv('RESULTS_THREAD_WORKERS', 4))
+
+
 # Logging settings
 
 LOGGING = {
@@ -13,6 +13,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 import vote.views
@@ -24,6 +25,14 @@ from vote.views import (
     CreateBallotView
 )
 
+# Async views are used when served by an ASGI server, see Procfile.asgi.
+if settings.ASYNC_VIEWS:
+    ResultsView = vote.views.AsyncResultsView
+    ElectionListPopularView = vote.views.AsyncElectionListPopularView
+    ElectionListLatestView = vote.views.AsyncElectionListLatestView
+else:
+    ResultsView = vote.views.ResultsView
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -38,14 +47,29 @@ urlpatterns = [
 
 
     path('<int:election_id>/results/',
-         vote.views.ResultsView.as_view(),
+         ResultsView.as_view(),
          name='view-results'),
     path('<int:election_id>/results/<str:etype>/',
-         vote.views.ResultsView.as_view(),
+         ResultsView.as_view(),
          name='view-results-etype'),
     path('<int:election_id>/results/<str:etype>/<int:numwinners>/',
-         vote.views.ResultsView.as_view(),
+         ResultsView.as_view(),
          name='view-results-etype-numwinners'),
+    path('<int:election_id>/compare/',
+         vote.views.CompareView.as_view(),
+         name='view-compare'),
+    path('<int:election_id>/compare/<int:numwinners>/',
+         vote.views.CompareView.as_view(),
+         name='view-compare-numwinners'),
+    path('<int:election_id>/ballots.csv',
+         vote.views.BallotExportView.as_view(),
+         name='export-ballots'),
+    path('<int:election_id>/ballots.parquet',
+         vote.views.BallotParquetExportView.as_view(),
+         name='export-ballots-parquet'),
+    path('<int:election_id>/api/ballots/',
+         vote.views.BallotApiView.as_view(),
+         name='api-ballots'),
 
 
 ]